@@ -1,56 +1,310 @@
 """
 Automatic Speech Recognition (ASR) module using Gemini and LangChain.
+Audio stays in memory: short clips are sent inline with the request, long recordings are
+uploaded through the Gemini Files API first.
 """
 
+import asyncio
+import io
+import math
 import os
+import struct
+import time
+from functools import lru_cache
+from typing import Dict, Optional, Set
 from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
+from model_registry import model_registry, ConcurrencyLimitExceeded
+from asr_cache import TranscriptCache
+from audio_preprocess import preprocess_wav
+from session_locks import TurnCoalescer
 
 load_dotenv()
 
+# Clips up to this size are sent inline; larger ones are uploaded (inline requests are capped at 20 MB)
+ASR_INLINE_MAX_BYTES = int(os.getenv("ASR_INLINE_MAX_BYTES", str(8 * 1024 * 1024)))
+# How long to wait for an uploaded file to finish processing
+ASR_UPLOAD_TIMEOUT_SECONDS = float(os.getenv("ASR_UPLOAD_TIMEOUT_SECONDS", "60"))
+# Largest recording accepted, by size and (where the header tells us) by length
+ASR_MAX_AUDIO_BYTES = int(os.getenv("ASR_MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))
+ASR_MAX_AUDIO_SECONDS = float(os.getenv("ASR_MAX_AUDIO_SECONDS", "300"))
+# Transcripts of recent clips, so a re-sent upload is answered without calling Gemini again.
+# Set ASR_CACHE_PATH to also keep them in a SQLite file that survives restarts.
+ASR_CACHE_MAX_ENTRIES = int(os.getenv("ASR_CACHE_MAX_ENTRIES", "2000"))
+ASR_CACHE_TTL_SECONDS = float(os.getenv("ASR_CACHE_TTL_SECONDS", "3600"))
+ASR_CACHE_PATH = os.getenv("ASR_CACHE_PATH") or None
+# Trim silence from WAV uploads and send them as 16 kHz mono (needs NumPy; skipped without it)
+ASR_PREPROCESS = os.getenv("ASR_PREPROCESS", "true").lower() in ("1", "true", "yes")
+
+TRANSCRIBE_PROMPT = "Transcribe the speech from this audio file. Only transcribe what is spoken, nothing else."
+
 class Transcription(BaseModel):
     """Transcription of audio content to text."""
     text: str = Field(description="The exact transcription of the speech from the audio file. Only transcribe what is spoken, nothing else.")
 
-def transcribe_audio(audio_data: bytes, mime_type: str = "audio/webm") -> str:
-    """
-    Transcribe audio using Gemini with structured output.
+class AudioTooLargeError(ValueError):
+    """Raised when a recording exceeds the size or duration limit"""
+
+class ASRBusyError(Exception):
+    """Raised when too many transcriptions are running and queued; retry_after is in seconds"""
     
-    Args:
-        audio_data: Raw audio data as bytes
-        mime_type: MIME type of the audio (e.g., "audio/webm", "audio/mpeg")
+    def __init__(self, retry_after: int):
+        super().__init__("Too many transcriptions in progress, please retry shortly")
+        self.retry_after = retry_after
+
+def wav_duration(audio_data: bytes) -> Optional[float]:
+    """Length in seconds of a RIFF/WAVE recording from its header, or None if it is not one"""
+    if len(audio_data) < 12 or audio_data[:4] != b"RIFF" or audio_data[8:12] != b"WAVE":
+        return None
     
-    Returns:
-        Transcribed text from the audio
-    """
+    byte_rate = None
+    offset = 12
+    # Walk the chunks: "fmt " carries the byte rate, "data" the sample bytes
+    while offset + 8 <= len(audio_data):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", audio_data, offset)
+        body = offset + 8
+        if chunk_id == b"fmt " and body + 12 <= len(audio_data):
+            byte_rate = struct.unpack_from("<I", audio_data, body + 8)[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streaming recorders leave the size as 0 or 0xFFFFFFFF; count what is there instead
+            available = len(audio_data) - body
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            return chunk_size / byte_rate
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+def normalize_mime_type(mime_type: str) -> str:
+    """Browsers send e.g. "audio/webm;codecs=opus"; Gemini wants the bare type"""
+    return mime_type.split(";")[0].strip().lower() or "audio/webm"
+
+@lru_cache(maxsize=1)
+def get_structured_model():
+    """Shared ASR model bound to the Transcription schema, built on first use"""
+    return model_registry.get("asr").with_structured_output(Transcription)
+
+class ASRService:
+    """Transcribes in-memory audio without temp files or blocking waits"""
     
-    # Initialize Gemini model with structured output
-    model = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-lite",
-        api_key=os.environ.get("GOOGLE_API_KEY"),
-    )
+    def __init__(
+        self,
+        inline_max_bytes: int = ASR_INLINE_MAX_BYTES,
+        upload_timeout: float = ASR_UPLOAD_TIMEOUT_SECONDS,
+        max_audio_bytes: int = ASR_MAX_AUDIO_BYTES,
+        max_audio_seconds: float = ASR_MAX_AUDIO_SECONDS,
+        cache: Optional[TranscriptCache] = None,
+        preprocess: bool = ASR_PREPROCESS,
+        poll_initial_delay: float = 0.2,
+        poll_max_delay: float = 2.0
+    ):
+        self.inline_max_bytes = inline_max_bytes
+        self.upload_timeout = upload_timeout
+        self.max_audio_bytes = max_audio_bytes
+        self.max_audio_seconds = max_audio_seconds
+        self.poll_initial_delay = poll_initial_delay
+        self.poll_max_delay = poll_max_delay
+        self.cache = cache or TranscriptCache()
+        self.preprocess = preprocess
+        # Identical clips transcribed at the same time share one call
+        self._in_flight = TurnCoalescer()
+        # Deletions of uploaded files still running in the background
+        self._cleanup_tasks: Set[asyncio.Task] = set()
+        # Moving average of transcription time, used to suggest a Retry-After
+        self._avg_seconds = 3.0
+        self.inline = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.rejected_busy = 0
+        self.rejected_too_large = 0
+        self.preprocessed = 0
+        self.bytes_saved = 0
     
-    # Use with_structured_output to force schema compliance
-    structured_model = model.with_structured_output(Transcription)
-    
-    # Create message with audio content
-    message = HumanMessage(
-        content=[
-            {
-                "type": "text",
-                "text": "Transcribe the speech from this audio file. Only transcribe what is spoken, nothing else."
-            },
-            {
-                "type": "media",
-                "mime_type": mime_type,
-                "data": audio_data,
-            }
-        ]
-    )
+    def check_audio(self, audio_data: bytes):
+        """Raise AudioTooLargeError if a recording is over the size or (WAV) duration limit"""
+        if len(audio_data) > self.max_audio_bytes:
+            self.rejected_too_large += 1
+            raise AudioTooLargeError(f"Audio exceeds the {self.max_audio_bytes // (1024 * 1024)} MB limit")
+        duration = wav_duration(audio_data)
+        if duration is not None and duration > self.max_audio_seconds:
+            self.rejected_too_large += 1
+            raise AudioTooLargeError(f"Audio is longer than {self.max_audio_seconds:g} seconds")
+    
+    def count_rejected_too_large(self):
+        """Record a recording turned away before it reached the service (e.g. by request size)"""
+        self.rejected_too_large += 1
+    
+    async def check_capacity(self, audio_data: bytes, mime_type: str):
+        """
+        Raise ASRBusyError right away if this clip would need a new transcription and the
+        queue is full; cached and in-flight clips are always accepted
+        """
+        if not model_registry.limit("asr").is_saturated():
+            return
+        key = self.cache.key(audio_data, normalize_mime_type(mime_type))
+        if key in self._in_flight or await self._cached(key) is not None:
+            return
+        self.rejected_busy += 1
+        raise ASRBusyError(self.retry_after())
     
-    # Get structured transcription
-    result: Transcription = structured_model.invoke([message])
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        limit = model_registry.limit("asr")
+        waiting = limit.stats()["waiting"]
+        return max(1, math.ceil(self._avg_seconds * (waiting + 1) / limit.limit))
     
-    return result.text
+    async def transcribe(self, audio_data: bytes, mime_type: str = "audio/webm") -> str:
+        """
+        Transcribe audio using Gemini with structured output.
+        
+        Args:
+            audio_data: Raw audio data as bytes
+            mime_type: MIME type of the audio (e.g., "audio/webm", "audio/mpeg")
+        
+        Returns:
+            Transcribed text from the audio
+        
+        Raises:
+            ValueError: If the audio is empty
+            AudioTooLargeError: If the audio is over the size or duration limit
+            ASRBusyError: If the ASR queue is full
+        """
+        if not audio_data:
+            raise ValueError("Empty audio file received")
+        self.check_audio(audio_data)
+        mime_type = normalize_mime_type(mime_type)
+        
+        key = self.cache.key(audio_data, mime_type)
+        cached = await self._cached(key)
+        if cached is not None:
+            return cached
+        return await self._in_flight.run(key, lambda: self._transcribe_uncached(key, audio_data, mime_type))
+    
+    async def _cached(self, key: str) -> Optional[str]:
+        text = self.cache.get(key)
+        if text is None and self.cache.disk_enabled:
+            text = await asyncio.to_thread(self.cache.load, key)
+        return text
+    
+    async def _transcribe_uncached(self, key: str, audio_data: bytes, mime_type: str) -> str:
+        if self.preprocess:
+            audio_data, mime_type = await self._preprocess(audio_data, mime_type)
+        
+        # Wait for a slot under the ASR concurrency limit; the whole call (upload included) holds it
+        try:
+            await model_registry.limit("asr").acquire_async()
+        except ConcurrencyLimitExceeded:
+            self.rejected_busy += 1
+            raise ASRBusyError(self.retry_after())
+        
+        started = time.perf_counter()
+        try:
+            if len(audio_data) <= self.inline_max_bytes:
+                self.inline += 1
+                text = await self._transcribe_part({"type": "media", "mime_type": mime_type, "data": audio_data})
+            else:
+                self.uploaded += 1
+                audio_file = await self._upload(audio_data, mime_type)
+                try:
+                    text = await self._transcribe_part({"type": "media", "mime_type": mime_type, "file_uri": audio_file.uri})
+                finally:
+                    self._delete_later(audio_file.name)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            model_registry.limit("asr").release()
+        
+        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.perf_counter() - started)
+        
+        self.cache.put(key, text)
+        if self.cache.disk_enabled:
+            await asyncio.to_thread(self.cache.persist, key, text)
+        return text
+    
+    async def _preprocess(self, audio_data: bytes, mime_type: str):
+        """Smaller WAV for the model when the upload is one; anything else is sent as received"""
+        if audio_data[:4] != b"RIFF":
+            return audio_data, mime_type
+        try:
+            processed = await asyncio.to_thread(preprocess_wav, audio_data)
+        except Exception as e:
+            print(f"Audio preprocessing failed, sending original: {e}")
+            return audio_data, mime_type
+        if processed is None:
+            return audio_data, mime_type
+        self.preprocessed += 1
+        self.bytes_saved += len(audio_data) - len(processed)
+        return processed, "audio/wav"
+    
+    async def _transcribe_part(self, media_part: Dict) -> str:
+        message = HumanMessage(content=[{"type": "text", "text": TRANSCRIBE_PROMPT}, media_part])
+        result: Transcription = await get_structured_model().ainvoke([message])
+        return result.text.strip()
+    
+    async def _upload(self, audio_data: bytes, mime_type: str):
+        """Upload audio from memory and wait, with exponential backoff, until it is processed"""
+        genai = model_registry.genai_client()
+        audio_file = await asyncio.to_thread(genai.upload_file, io.BytesIO(audio_data), mime_type=mime_type)
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.upload_timeout
+        delay = self.poll_initial_delay
+        while audio_file.state.name == "PROCESSING":
+            if loop.time() + delay > deadline:
+                self._delete_later(audio_file.name)
+                raise TimeoutError("Audio file processing timed out")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max_delay)
+            audio_file = await asyncio.to_thread(genai.get_file, audio_file.name)
+        
+        if audio_file.state.name == "FAILED":
+            self._delete_later(audio_file.name)
+            raise RuntimeError("Audio file processing failed")
+        return audio_file
+    
+    def _delete_later(self, name: str):
+        """Delete an uploaded file without making the caller wait (files also expire after 48 hours)"""
+        async def delete():
+            try:
+                await asyncio.to_thread(model_registry.genai_client().delete_file, name)
+            except Exception as e:
+                print(f"Could not delete uploaded audio {name}: {e}")
+        
+        task = asyncio.create_task(delete())
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+    
+    def stats(self) -> Dict:
+        """Transcription counters by path"""
+        limit = model_registry.limit("asr").stats()
+        return {
+            "active": limit["active"],
+            "queue_depth": limit["waiting"],
+            "max_queue": limit["max_waiting"],
+            "inline": self.inline,
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "rejected_busy": self.rejected_busy,
+            "rejected_too_large": self.rejected_too_large,
+            "avg_seconds": round(self._avg_seconds, 3),
+            "coalesced": self._in_flight.coalesced,
+            "preprocessed": self.preprocessed,
+            "bytes_saved": self.bytes_saved,
+            "cache": self.cache.stats()
+        }
+
+# Global ASR service instance
+asr_service = ASRService(
+    cache=TranscriptCache(
+        max_entries=ASR_CACHE_MAX_ENTRIES,
+        ttl_seconds=ASR_CACHE_TTL_SECONDS,
+        path=ASR_CACHE_PATH
+    )
+)
+
+async def transcribe_audio(audio_data: bytes, mime_type: str = "audio/webm") -> str:
+    """Transcribe audio with the shared ASR service"""
+    return await asr_service.transcribe(audio_data, mime_type)
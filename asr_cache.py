@@ -0,0 +1,123 @@
+"""
+Cache of transcripts keyed by a hash of the audio bytes and MIME type, so a re-sent clip is
+not transcribed again: a bounded in-memory LRU over an optional SQLite file.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from ttl_cache import TTLCache
+
+
+class TranscriptCache:
+    """In-memory LRU of transcripts with an optional on-disk tier that survives restarts"""
+    
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        ttl_seconds: Optional[float] = 3600,
+        path: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+        disk_max_age_seconds: float = 7 * 24 * 3600,
+        prune_every: int = 1000
+    ):
+        self._memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.disk_max_age_seconds = disk_max_age_seconds
+        self.prune_every = prune_every
+        self._writes_since_prune = 0
+        self.disk_hits = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_transcripts_stored_at ON transcripts(stored_at)")
+    
+    @staticmethod
+    def key(audio_data: bytes, mime_type: str) -> str:
+        """sha256 over the MIME type and the audio bytes"""
+        digest = hashlib.sha256(mime_type.encode())
+        digest.update(b"\0")
+        digest.update(audio_data)
+        return digest.hexdigest()
+    
+    @property
+    def disk_enabled(self) -> bool:
+        return self._conn is not None
+    
+    def get(self, key: str) -> Optional[str]:
+        """Transcript from memory"""
+        return self._memory.get(key)
+    
+    def load(self, key: str) -> Optional[str]:
+        """Transcript from disk, promoted into memory (blocking; call from a worker thread)"""
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM transcripts WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - self.disk_max_age_seconds)
+            ).fetchone()
+        if row is None:
+            return None
+        self.disk_hits += 1
+        self._memory.set(key, row[0])
+        return row[0]
+    
+    def put(self, key: str, text: str):
+        """Store a transcript in memory"""
+        self._memory.set(key, text)
+    
+    def persist(self, key: str, text: str):
+        """Store a transcript on disk (blocking; call from a worker thread)"""
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transcripts (key, text, stored_at) VALUES (?, ?, ?)",
+                (key, text, time.time())
+            )
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= self.prune_every:
+                self._prune()
+    
+    def _prune(self):
+        self._writes_since_prune = 0
+        self._conn.execute("DELETE FROM transcripts WHERE stored_at < ?", (time.time() - self.disk_max_age_seconds,))
+        self._conn.execute(
+            "DELETE FROM transcripts WHERE key IN (SELECT key FROM transcripts ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+    
+    def stats(self) -> Dict:
+        """Memory tier counters plus disk tier hits"""
+        return {
+            **self._memory.stats(),
+            "disk_enabled": self.disk_enabled,
+            "disk_hits": self.disk_hits
+        }
+    
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
@@ -0,0 +1,164 @@
+"""
+Shrinks WAV recordings before transcription: leading and trailing silence is trimmed with an
+energy-based voice activity detector, channels are mixed down to mono and the audio is
+resampled to 16 kHz, 16-bit PCM. Other formats (webm/opus, mp3) are already compressed and
+are passed through unchanged.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TARGET_SAMPLE_RATE = 16000
+# VAD frames of 20 ms; a frame is speech when its RMS is this many dB above the noise floor
+FRAME_SECONDS = 0.02
+SPEECH_MARGIN_DB = 12.0
+# Absolute floor so a clip of pure digital silence is not all "speech"
+MIN_SPEECH_DBFS = -50.0
+# Audio kept on each side of the detected speech, so soft onsets and endings survive
+PAD_SECONDS = 0.25
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+@dataclass
+class WavAudio:
+    """Decoded samples as float32 in [-1, 1], shape (frames, channels)"""
+    samples: "np.ndarray"
+    sample_rate: int
+
+
+def decode_wav(audio_data: bytes) -> Optional[WavAudio]:
+    """Decode a PCM (8/16/24/32-bit) or float WAV file, or None if it is not one we can read"""
+    if np is None or len(audio_data) < 12 or audio_data[:4] != b"RIFF" or audio_data[8:12] != b"WAVE":
+        return None
+    
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(audio_data):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", audio_data, offset)
+        body = offset + 8
+        if chunk_id == b"fmt " and body + 16 <= len(audio_data):
+            fmt = struct.unpack_from("<HHIIHH", audio_data, body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40 and body + 26 <= len(audio_data):
+                # The real format code is the first field of the sub-format GUID
+                sub_format = struct.unpack_from("<H", audio_data, body + 24)[0]
+                fmt = (sub_format,) + fmt[1:]
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            # Streaming recorders leave the size as 0 or 0xFFFFFFFF; use what is there instead
+            available = len(audio_data) - body
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            return _decode_samples(audio_data[body:body + chunk_size], *fmt)
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _decode_samples(data: bytes, format_code: int, channels: int, sample_rate: int,
+                    byte_rate: int, block_align: int, bits: int) -> Optional[WavAudio]:
+    if channels < 1 or sample_rate < 1 or block_align < 1:
+        return None
+    width = block_align // channels
+    data = data[:len(data) - len(data) % block_align]
+    
+    if format_code == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        samples = np.frombuffer(data, dtype=f"<f{width}").astype(np.float32)
+    elif format_code == WAVE_FORMAT_PCM and width == 1:
+        # 8-bit WAV is unsigned
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif format_code == WAVE_FORMAT_PCM and width in (2, 4):
+        samples = np.frombuffer(data, dtype=f"<i{width}").astype(np.float32) / float(1 << (8 * width - 1))
+    elif format_code == WAVE_FORMAT_PCM and width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / float(1 << 23)
+    else:
+        return None
+    return WavAudio(samples=samples.reshape(-1, channels), sample_rate=sample_rate)
+
+
+def to_mono(samples: "np.ndarray") -> "np.ndarray":
+    """Average the channels"""
+    return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+
+
+def trim_silence(samples: "np.ndarray", sample_rate: int) -> "np.ndarray":
+    """
+    Cut leading and trailing silence from mono samples. The noise floor is the quietest tenth
+    of the frames; speech is anything well above it (and above MIN_SPEECH_DBFS).
+    Returns the input unchanged when no frame qualifies.
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    if count < 2:
+        return samples
+    
+    frames = samples[:count * frame].reshape(count, frame)
+    rms_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+    noise_floor = np.percentile(rms_db, 10)
+    threshold = max(noise_floor + SPEECH_MARGIN_DB, MIN_SPEECH_DBFS)
+    
+    speech = np.flatnonzero(rms_db > threshold)
+    if len(speech) == 0:
+        return samples
+    pad = int(sample_rate * PAD_SECONDS)
+    start = max(0, speech[0] * frame - pad)
+    end = min(len(samples), (speech[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def resample(samples: "np.ndarray", sample_rate: int, target_rate: int = TARGET_SAMPLE_RATE) -> "np.ndarray":
+    """
+    Resample mono samples by linear interpolation. When downsampling, a moving average over
+    one output period first removes most content above the new Nyquist frequency.
+    """
+    if sample_rate == target_rate or len(samples) == 0:
+        return samples
+    if sample_rate > target_rate:
+        width = int(round(sample_rate / target_rate))
+        if width > 1:
+            samples = np.convolve(samples, np.full(width, 1.0 / width, dtype=np.float32), mode="same")
+    
+    duration = len(samples) / sample_rate
+    target_length = max(1, int(round(duration * target_rate)))
+    positions = np.arange(target_length, dtype=np.float64) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def encode_wav(samples: "np.ndarray", sample_rate: int) -> bytes:
+    """Mono 16-bit PCM WAV file"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).round().astype("<i2").tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(pcm), b"WAVE",
+        b"fmt ", 16, WAVE_FORMAT_PCM, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", len(pcm)
+    )
+    return header + pcm
+
+
+def preprocess_wav(audio_data: bytes) -> Optional[bytes]:
+    """
+    Trimmed 16 kHz mono 16-bit WAV for a WAV recording, or None when the input is not a
+    readable WAV, NumPy is missing, or the result would not be smaller.
+    CPU-bound; call from a worker thread.
+    """
+    audio = decode_wav(audio_data)
+    if audio is None or len(audio.samples) == 0:
+        return None
+    
+    samples = to_mono(audio.samples)
+    samples = trim_silence(samples, audio.sample_rate)
+    samples = resample(samples, audio.sample_rate)
+    processed = encode_wav(samples, TARGET_SAMPLE_RATE)
+    return processed if len(processed) < len(audio_data) else None
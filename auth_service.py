@@ -6,6 +6,10 @@ from supabase import create_client, Client
 from fastapi import HTTPException, Depends, Header
 from typing import Optional
 import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 import jwt
 
@@ -17,6 +21,12 @@ supabase_key = os.getenv("SUPABASE_ANON_KEY")
 supabase_service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 jwt_secret = os.getenv("SUPABASE_JWT_SECRET")
 
+# Verify access tokens in-process with the JWT secret. Set AUTH_REMOTE_VERIFY=true to
+# always ask Supabase instead (also used automatically when no JWT secret is configured).
+auth_remote_verify = os.getenv("AUTH_REMOTE_VERIFY", "false").lower() in ("1", "true", "yes")
+token_cache_size = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+revoked_tokens_size = int(os.getenv("AUTH_REVOKED_TOKENS_SIZE", "100000"))
+
 if not all([supabase_url, supabase_key]):
     raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
 
@@ -27,6 +37,87 @@ supabase: Client = create_client(supabase_url, supabase_key)
 supabase_admin: Client = create_client(supabase_url, supabase_service_key) if supabase_service_key else None
 
 
+class TokenCache:
+    """
+    Bounded LRU cache of access token -> user dict, each entry expiring with the token's exp.
+    Entries also carry the token's revocation key so a cached token can still be refused
+    after sign-out.
+    """
+    
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[dict, float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, token: str) -> Optional["tuple[dict, str]"]:
+        """Return (user, revocation key) for a token, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at, revocation_key = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user, revocation_key
+    
+    def set(self, token: str, user: dict, expires_at: float, revocation_key: str):
+        """Cache a user until expires_at (unix timestamp)"""
+        with self._lock:
+            self._entries[token] = (user, expires_at, revocation_key)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, token: str):
+        """Drop a token from the cache"""
+        with self._lock:
+            self._entries.pop(token, None)
+
+
+class RevokedTokens:
+    """
+    Signed-out logins of this process, each remembered until its access token would have
+    expired anyway. Bounded: past max_size the oldest revocations are forgotten first.
+    """
+    
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def revoke(self, key: str, expires_at: float):
+        with self._lock:
+            self._entries[key] = expires_at
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def is_revoked(self, key: str) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self._entries[key]
+                return False
+            return True
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def revocation_key(payload: dict, access_token: str) -> str:
+    """One key per login: Supabase's session_id claim, else jti, else the token itself"""
+    claim = payload.get("session_id") or payload.get("jti")
+    return f"session:{claim}" if claim else f"token:{access_token}"
+
+
+token_cache = TokenCache(max_size=token_cache_size)
+revoked_tokens = RevokedTokens(max_size=revoked_tokens_size)
+
+
 class AuthService:
     """Service for handling Supabase authentication"""
     
@@ -143,11 +234,19 @@ class AuthService:
     async def sign_out(access_token: str):
         """Sign out the current user"""
         try:
-            # Set the session
-            supabase.auth.set_session(access_token, access_token)
+            # Revoke by token; never touches the shared client's session state
+            await asyncio.to_thread(supabase.auth.admin.sign_out, access_token)
             
-            # Sign out
-            supabase.auth.sign_out()
+            # Local verification would keep accepting the signed token until exp, so refuse
+            # its login in this process from now on. Other worker processes only learn of
+            # the sign-out when the token expires (or always, with AUTH_REMOTE_VERIFY=true).
+            try:
+                payload = jwt.decode(access_token, options={"verify_signature": False})
+            except jwt.InvalidTokenError:
+                payload = {}
+            expires_at = payload.get("exp") or time.time() + 3600
+            revoked_tokens.revoke(revocation_key(payload, access_token), expires_at)
+            token_cache.invalidate(access_token)
             
             return {"message": "Sign out successful!"}
                 
@@ -180,13 +279,44 @@ class AuthService:
     
     @staticmethod
     async def get_current_user(access_token: str):
-        """Get the current authenticated user"""
+        """Get the current authenticated user (verified locally unless remote verification is requested)"""
+        if jwt_secret and not auth_remote_verify:
+            return await AuthService.get_user_from_token(access_token)
+        
+        return await AuthService.get_remote_user(access_token)
+    
+    @staticmethod
+    async def get_user_from_token(access_token: str) -> dict:
+        """Verify the JWT in-process and build the user from its claims, using the token cache"""
+        cached = token_cache.get(access_token)
+        if cached is not None:
+            user, key = cached
+            if revoked_tokens.is_revoked(key):
+                raise HTTPException(status_code=401, detail="Token has been revoked")
+            return user
+        
+        payload = await AuthService.verify_token(access_token)
+        key = revocation_key(payload, access_token)
+        if revoked_tokens.is_revoked(key):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        
+        user = {
+            "id": payload["sub"],
+            "email": payload.get("email"),
+            "email_confirmed_at": None,  # Not part of the JWT claims
+            "user_metadata": payload.get("user_metadata", {}),
+            "created_at": None,  # Not part of the JWT claims
+        }
+        
+        token_cache.set(access_token, user, payload["exp"], key)
+        return user
+    
+    @staticmethod
+    async def get_remote_user(access_token: str):
+        """Get the current authenticated user from Supabase"""
         try:
-            # Set the session
-            supabase.auth.set_session(access_token, access_token)
-            
-            # Get user
-            response = supabase.auth.get_user(access_token)
+            # Look the user up by token; never touches the shared client's session state
+            response = await asyncio.to_thread(supabase.auth.get_user, access_token)
             
             if response.user:
                 return {
@@ -209,8 +339,14 @@ class AuthService:
             if not jwt_secret:
                 raise HTTPException(status_code=500, detail="JWT secret not configured")
             
-            # Decode JWT
-            payload = jwt.decode(access_token, jwt_secret, algorithms=["HS256"])
+            # Decode JWT (checks signature, expiry and the Supabase audience)
+            payload = jwt.decode(
+                access_token,
+                jwt_secret,
+                algorithms=["HS256"],
+                audience="authenticated",
+                options={"require": ["exp", "sub"]}
+            )
             
             return payload
                 
@@ -0,0 +1,52 @@
+"""
+Per-request cost of create_agent_with_memory: rebuilding the tool-calling agent and its
+executor on every call (before) versus copying the executor built once at import (after).
+
+    python benchmarks/agent_setup.py [--iterations 300]
+"""
+
+import argparse
+import timeit
+
+import common  # noqa: F401  (sets up the import path and placeholder credentials)
+
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain.memory import ConversationBufferWindowMemory
+
+import main
+from prompt import prompt
+from tools import tools
+
+
+def create_agent_per_request(memory: ConversationBufferWindowMemory) -> AgentExecutor:
+    """What create_agent_with_memory did before the executor was shared"""
+    llm_with_tools = main.model.bind_tools(tools)
+    agent = create_tool_calling_agent(llm=llm_with_tools, prompt=prompt, tools=tools)
+    return AgentExecutor.from_agent_and_tools(
+        agent=agent,
+        tools=tools,
+        memory=memory,
+        verbose=True,
+        handle_parsing_errors=True
+    )
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+    
+    memory = ConversationBufferWindowMemory(k=10, memory_key="chat_history", return_messages=True)
+    
+    print(f"create_agent_with_memory, {args.iterations} calls:")
+    for label, create in (
+        ("before (rebuild per request)", create_agent_per_request),
+        ("after (copy shared executor)", main.create_agent_with_memory),
+    ):
+        create(memory)
+        seconds = timeit.timeit(lambda: create(memory), number=args.iterations)
+        common.report(label, seconds / args.iterations, "us")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,33 @@
+"""
+Shared setup for the benchmark scripts: makes the repository importable and fills in
+placeholder credentials, since the server modules read them at import time. Nothing here
+talks to Supabase or Gemini.
+
+Run a benchmark from the repository root, e.g. `python benchmarks/agent_setup.py`.
+"""
+
+import os
+import sys
+import warnings
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_ANON_KEY", "benchmark-anon-key")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "benchmark-service-role-key")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-google-api-key")
+os.environ.setdefault("MESSAGE_WRITE_BEHIND", "false")
+
+# LangChain memory deprecation notices would drown out the results (langchain_core
+# and langchain install their own warning filters on import, so they are imported first)
+import langchain  # noqa: E402,F401
+warnings.filterwarnings("ignore")
+
+
+def report(label: str, value: float, unit: str = "ms"):
+    """Print one result; value is in seconds for time units, in bytes for the bytes unit"""
+    scale = {"s": 1, "ms": 1e3, "us": 1e6, "bytes": 1}[unit]
+    print(f"  {label:<40} {value * scale:10.2f} {unit}")
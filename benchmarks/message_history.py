@@ -0,0 +1,78 @@
+"""
+Loading the memory window of a long session: fetching every message and keeping the last
+N (before) versus letting the database return only the last N (after), for sessions of
+10, 1,000 and 10,000 messages on a PostgREST stand-in.
+
+    python benchmarks/message_history.py [--window 20] [--repeat 20] [--delay 0.02]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import common
+from postgrest_standin import PostgRESTStandIn
+
+SESSION_SIZES = (10, 1_000, 10_000)
+QUESTION = "How much urea should I apply for 2 acres of wheat in Punjab this rabi season?"
+ANSWER = "For wheat, apply about 50 kg of urea per acre in two or three split doses. " * 3
+
+
+def seed(standin: PostgRESTStandIn, session_id: str, count: int):
+    standin.insert("chat_messages", [
+        {
+            "id": f"{session_id}-{i}",
+            "session_id": session_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": QUESTION if i % 2 == 0 else ANSWER,
+            "created_at": f"2024-01-01T00:00:00.{i:06d}+00:00"
+        }
+        for i in range(count)
+    ])
+
+
+async def time_load(load, repeat: int) -> float:
+    await load()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await load()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--window", type=int, default=20, help="messages kept in memory")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02, help="stand-in latency per request (s)")
+    args = parser.parse_args()
+    
+    standin = PostgRESTStandIn(delay=args.delay).start()
+    for count in SESSION_SIZES:
+        seed(standin, f"session-{count}", count)
+    os.environ["SUPABASE_URL"] = standin.url
+    from supabase_session_manager import SupabaseSessionManager
+    manager = SupabaseSessionManager()
+    
+    async def fetch_all_then_slice(session_id):
+        return (await manager.get_messages(session_id))[-args.window:]
+    
+    async def fetch_last(session_id):
+        return await manager.get_messages(session_id, limit=args.window)
+    
+    async def run():
+        print(f"Last {args.window} messages, {args.delay * 1000:.0f} ms per request:")
+        for count in SESSION_SIZES:
+            session_id = f"session-{count}"
+            before, after = await fetch_all_then_slice(session_id), await fetch_last(session_id)
+            assert [m["id"] for m in before] == [m["id"] for m in after]
+            print(f" {count:>6} messages")
+            common.report("before (fetch all, slice)", await time_load(lambda: fetch_all_then_slice(session_id), args.repeat))
+            common.report("after (order desc + limit)", await time_load(lambda: fetch_last(session_id), args.repeat))
+    
+    asyncio.run(run())
+    standin.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+In-process stand-in for the PostgREST API that supabase-py talks to, for benchmarks.
+
+Tables live in memory. It understands the subset of PostgREST the session manager uses:
+`col=eq.value` filters, `order=col.asc|desc`, `limit`, insert/upsert (with
+ignore-duplicates), update and delete. Every request sleeps `delay` seconds first, to
+stand in for the network round trip and query time of a hosted database.
+"""
+
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+class PostgRESTStandIn:
+    """Serves /rest/v1/<table> from in-memory rows on a local port"""
+    
+    def __init__(self, delay: float = 0.1):
+        self.delay = delay
+        self.tables: Dict[str, List[Dict]] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+    
+    def start(self) -> "PostgRESTStandIn":
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def insert(self, table: str, rows: List[Dict]):
+        """Seed rows directly, without a request"""
+        with self._lock:
+            self.tables.setdefault(table, []).extend(rows)
+    
+    def _select(self, table: str, query: Dict[str, List[str]]) -> List[Dict]:
+        rows = self.tables.get(table, [])
+        filters = [
+            (column, values[0][3:])
+            for column, values in query.items()
+            if column not in RESERVED_PARAMS and values[0].startswith("eq.")
+        ]
+        rows = [row for row in rows if all(str(row.get(column)) == value for column, value in filters)]
+        
+        if "order" in query:
+            column, _, direction = query["order"][0].split(",")[0].partition(".")
+            rows = sorted(rows, key=lambda row: row.get(column) or "", reverse=direction.startswith("desc"))
+        offset = int(query["offset"][0]) if "offset" in query else 0
+        if "limit" in query:
+            return rows[offset:offset + int(query["limit"][0])]
+        return rows[offset:]
+    
+    def _handler(self):
+        standin = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this, delayed ACKs add ~40 ms
+            disable_nagle_algorithm = True
+            
+            def _route(self):
+                url = urlparse(self.path)
+                return url.path.rsplit("/", 1)[-1], parse_qs(url.query)
+            
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length)) if length else None
+            
+            def _reply(self, status: int, rows):
+                body = json.dumps(rows).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                table, query = self._route()
+                time.sleep(standin.delay)
+                with standin._lock:
+                    standin.requests += 1
+                    rows = standin._select(table, query)
+                self._reply(200, rows)
+            
+            def do_POST(self):
+                table, _ = self._route()
+                body = self._body()
+                time.sleep(standin.delay)
+                ignore_duplicates = "ignore-duplicates" in (self.headers.get("Prefer") or "")
+                now = datetime.now(timezone.utc).isoformat()
+                with standin._lock:
+                    standin.requests += 1
+                    rows = standin.tables.setdefault(table, [])
+                    existing = {row.get("id") for row in rows}
+                    inserted = []
+                    for row in body if isinstance(body, list) else [body]:
+                        if ignore_duplicates and row.get("id") in existing:
+                            continue
+                        row = {"id": str(uuid.uuid4()), "created_at": now, "updated_at": now, **row}
+                        rows.append(row)
+                        inserted.append(row)
+                self._reply(201, inserted)
+            
+            def do_PATCH(self):
+                table, query = self._route()
+                changes = self._body() or {}
+                time.sleep(standin.delay)
+                with standin._lock:
+                    standin.requests += 1
+                    rows = standin._select(table, query)
+                    for row in rows:
+                        row.update(changes)
+                self._reply(200, rows)
+            
+            def do_DELETE(self):
+                table, query = self._route()
+                time.sleep(standin.delay)
+                with standin._lock:
+                    standin.requests += 1
+                    doomed = standin._select(table, query)
+                    ids = {id(row) for row in doomed}
+                    standin.tables[table] = [row for row in standin.tables.get(table, []) if id(row) not in ids]
+                self._reply(200, doomed)
+            
+            def log_message(self, *args):
+                pass
+        
+        return Handler
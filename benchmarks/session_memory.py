@@ -0,0 +1,103 @@
+"""
+Memory per anonymous session and get/create throughput of the in-memory SessionManager,
+against the previous design (one ConversationBufferWindowMemory per session whose message
+list grew without bound).
+
+    python benchmarks/session_memory.py [--sessions 20000] [--turns 30]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+
+import common
+
+from langchain.memory import ConversationBufferWindowMemory
+
+from session_manager import SessionManager
+
+QUESTION = "How much urea should I apply for wheat on 2 acres in Punjab?"
+ANSWER = "For wheat, apply about 50 kg urea per acre in split doses. " * 3
+
+
+class LegacySessionManager:
+    """The SessionManager before SessionRecord: a full LangChain memory object per session"""
+    
+    def __init__(self, max_sessions: int, memory_window: int = 10):
+        self.max_sessions = max_sessions
+        self.memory_window = memory_window
+        self.sessions = OrderedDict()
+    
+    def get_or_create_session(self, session_id=None):
+        if session_id and session_id in self.sessions:
+            self.sessions[session_id]["last_accessed"] = time.time()
+            self.sessions.move_to_end(session_id)
+            return session_id, self.sessions[session_id]["memory"]
+        
+        if not session_id:
+            session_id = str(uuid.uuid4())
+        if len(self.sessions) >= self.max_sessions:
+            del self.sessions[next(iter(self.sessions))]
+        
+        memory = ConversationBufferWindowMemory(k=self.memory_window, memory_key="chat_history", return_messages=True)
+        self.sessions[session_id] = {"memory": memory, "created_at": time.time(), "last_accessed": time.time()}
+        return session_id, memory
+
+
+def traced_bytes(action) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    action()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def per_call(action, count: int) -> float:
+    started = time.perf_counter()
+    action()
+    return (time.perf_counter() - started) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20_000)
+    parser.add_argument("--turns", type=int, default=30, help="turns saved per session for the full-session figure")
+    args = parser.parse_args()
+    
+    ids = [f"anon-{uuid.uuid4()}" for _ in range(args.sessions)]
+    # Full sessions are measured on a sample; saving context is slow in both designs
+    sample = ids[:max(1, args.sessions // 20)]
+    
+    print(f"{args.sessions} sessions, {args.turns} turns per full session:")
+    for label, create_manager in (
+        ("before (memory object per session)", lambda: LegacySessionManager(max_sessions=args.sessions)),
+        ("after (SessionRecord ring buffer)", lambda: SessionManager(max_sessions=args.sessions)),
+    ):
+        print(f" {label}")
+        manager = create_manager()
+        
+        def create_all():
+            for session_id in ids:
+                manager.get_or_create_session(session_id)
+        
+        def fill_sample():
+            for session_id in sample:
+                _, memory = manager.get_or_create_session(session_id)
+                for turn in range(args.turns):
+                    memory.save_context({"text": QUESTION}, {"output": ANSWER})
+        
+        common.report("empty session", traced_bytes(create_all) / args.sessions, "bytes")
+        common.report(f"extra for {args.turns} turns", traced_bytes(fill_sample) / len(sample), "bytes")
+        
+        manager = create_manager()
+        common.report("create", per_call(create_all, args.sessions), "us")
+        common.report("get (hit)", per_call(create_all, args.sessions), "us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Concurrent get_user_sessions and add_message calls against a PostgREST stand-in with a fixed
+per-request delay: blocking execute() on the event loop (before) versus the bounded DB
+thread pool (after). Also reports the worst stall seen by a 10 ms ticker on the loop.
+
+    python benchmarks/supabase_concurrency.py [--calls 16] [--delay 0.1]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import common
+from postgrest_standin import PostgRESTStandIn
+
+
+async def ticker(stop: asyncio.Event) -> float:
+    """Worst gap between 10 ms ticks while the calls run"""
+    worst = 0.0
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        worst = max(worst, now - last - 0.01)
+        last = now
+    return worst
+
+
+async def run_calls(manager, calls: int) -> tuple:
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(ticker(stop))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *[manager.get_user_sessions("benchmark-user") for _ in range(calls)],
+        *[manager.add_message("benchmark-session", "user", "How much urea for wheat?") for _ in range(calls)]
+    )
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return elapsed, await watcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=16, help="calls of each kind")
+    parser.add_argument("--delay", type=float, default=0.1, help="stand-in latency per request (s)")
+    args = parser.parse_args()
+    
+    standin = PostgRESTStandIn(delay=args.delay).start()
+    standin.insert("chat_sessions", [{
+        "id": "benchmark-session",
+        "user_id": "benchmark-user",
+        "title": "Wheat fertilizer",
+        "is_public": False,
+        "created_at": "2024-01-01T00:00:00+00:00",
+        "updated_at": "2024-01-01T00:00:00+00:00"
+    }])
+    os.environ["SUPABASE_URL"] = standin.url
+    from supabase_session_manager import SupabaseSessionManager
+    
+    async def execute_on_loop(query):
+        return query.execute()
+    
+    print(f"{args.calls} get_user_sessions + {args.calls} add_message, {args.delay * 1000:.0f} ms per request:")
+    for label, blocking in (("before (execute on the event loop)", True), ("after (DB thread pool)", False)):
+        manager = SupabaseSessionManager()
+        if blocking:
+            manager._execute = execute_on_loop
+        elapsed, worst_gap = asyncio.run(run_calls(manager, args.calls))
+        common.report(label, elapsed)
+        common.report("  worst event loop stall", worst_gap)
+    standin.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-from langchain.chat_models import init_chat_model
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain.memory import ConversationBufferWindowMemory
 from prompt import prompt
 from tools import tools
+from model_registry import model_registry
 
 try:
     from dotenv import load_dotenv
@@ -10,33 +10,30 @@ try:
 except ImportError:
     pass
 
-model = init_chat_model("gemini-2.5-flash", model_provider="google_genai")
+# Shared client from the model registry (one connection pool for all requests)
+model = model_registry.get("agent")
 
 llm_with_tools = model.bind_tools(tools)
 
-def create_agent_with_memory(memory: ConversationBufferWindowMemory) -> AgentExecutor:
-    """Create an agent executor with memory"""
-    agent = create_tool_calling_agent(
-        llm=llm_with_tools,
-        prompt=prompt,
-        tools=tools,
-    )
-    
-    return AgentExecutor.from_agent_and_tools(
-        agent=agent, 
-        tools=tools, 
-        memory=memory,
-        verbose=True,
-        handle_parsing_errors=True
-    )
-
+# Build the agent runnable and executor once at startup. Both are stateless and
+# safe to share across concurrent requests; only the memory differs per session.
 agent = create_tool_calling_agent(
     llm=llm_with_tools,
     prompt=prompt,
     tools=tools,
 )
 
-agent_executor = AgentExecutor.from_agent_and_tools(agent=agent, tools=tools, verbose=True)
+agent_executor = AgentExecutor.from_agent_and_tools(
+    agent=agent,
+    tools=tools,
+    verbose=True,
+    handle_parsing_errors=True
+)
+
+def create_agent_with_memory(memory: ConversationBufferWindowMemory) -> AgentExecutor:
+    """Attach a session's memory to the shared, pre-built agent executor"""
+    # Shallow copy: the agent runnable and tools are shared, only memory is swapped in
+    return agent_executor.model_copy(update={"memory": memory})
 
 if __name__ == "__main__":
     response = agent_executor.invoke({"text": "which is the best crop to sow in rajasthan in the month of july?"})
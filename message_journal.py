@@ -0,0 +1,266 @@
+"""
+Write-behind persistence for chat messages: messages are appended to a durable local
+SQLite journal and flushed to Supabase in batches by a background task.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class MessageJournal:
+    """Append-only SQLite (WAL) journal of messages not yet written to the database"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Last timestamp handed out, so messages of one turn keep a strict order
+        self._last_created_at = datetime.now(timezone.utc)
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # fsync every append: an acknowledged message must survive a crash
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_messages_session_id ON pending_messages(session_id)")
+    
+    def append(self, session_id: str, messages: List[Dict]) -> List[Dict]:
+        """Journal messages (dicts with role and content) and return them as database rows"""
+        with self._lock:
+            rows = []
+            for msg in messages:
+                created_at = max(datetime.now(timezone.utc), self._last_created_at + timedelta(microseconds=1))
+                self._last_created_at = created_at
+                rows.append({
+                    "id": str(uuid.uuid4()),
+                    "session_id": session_id,
+                    "role": msg["role"],
+                    "content": msg["content"],
+                    "created_at": created_at.isoformat()
+                })
+            
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO pending_messages (id, session_id, role, content, created_at) VALUES (:id, :session_id, :role, :content, :created_at)",
+                rows
+            )
+            self._conn.execute("COMMIT")
+        return rows
+    
+    def pending_for(self, session_id: str) -> List[Dict]:
+        """Unflushed messages of a session, oldest first"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT id, role, content, created_at FROM pending_messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            )
+            return [
+                {"id": row[0], "role": row[1], "content": row[2], "created_at": row[3]}
+                for row in cursor.fetchall()
+            ]
+    
+    def has_pending(self, session_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM pending_messages WHERE session_id = ? LIMIT 1", (session_id,)
+            ).fetchone() is not None
+    
+    def take_batch(self, limit: int) -> List[Dict]:
+        """Oldest unflushed messages, in journal order"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT seq, id, session_id, role, content, created_at, attempts FROM pending_messages ORDER BY seq LIMIT ?",
+                (limit,)
+            )
+            return [
+                {
+                    "seq": row[0],
+                    "id": row[1],
+                    "session_id": row[2],
+                    "role": row[3],
+                    "content": row[4],
+                    "created_at": row[5],
+                    "attempts": row[6]
+                }
+                for row in cursor.fetchall()
+            ]
+    
+    def remove(self, seqs: List[int]):
+        """Drop flushed messages"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending_messages WHERE seq = ?", [(seq,) for seq in seqs])
+    
+    def mark_failed(self, seqs: List[int]):
+        """Count a failed flush attempt"""
+        with self._lock:
+            self._conn.executemany("UPDATE pending_messages SET attempts = attempts + 1 WHERE seq = ?", [(seq,) for seq in seqs])
+    
+    def discard_session(self, session_id: str):
+        """Drop unflushed messages of a deleted session"""
+        with self._lock:
+            self._conn.execute("DELETE FROM pending_messages WHERE session_id = ?", (session_id,))
+    
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_messages").fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WriteBehindPersister:
+    """Acknowledges messages once journaled and flushes them to the database in the background"""
+    
+    def __init__(
+        self,
+        journal: MessageJournal,
+        flush: Callable[[List[Dict]], Awaitable[None]],
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_retry_delay: float = 30.0,
+        is_permanent_error: Optional[Callable[[Exception], bool]] = None
+    ):
+        self.journal = journal
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        # Tells a row the database will never accept (e.g. its session was deleted) from an
+        # outage; without it every failure is treated as transient and retried
+        self.is_permanent_error = is_permanent_error or (lambda e: False)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+    
+    async def enqueue(self, session_id: str, messages: List[Dict]) -> List[Dict]:
+        """Journal messages durably and schedule them for flushing"""
+        rows = await asyncio.to_thread(self.journal.append, session_id, messages)
+        self._wakeup.set()
+        return rows
+    
+    def pending_for(self, session_id: str) -> List[Dict]:
+        return self.journal.pending_for(session_id)
+    
+    def has_pending(self, session_id: str) -> bool:
+        return self.journal.has_pending(session_id)
+    
+    def discard_session(self, session_id: str):
+        self.journal.discard_session(session_id)
+    
+    def start(self):
+        """Start flushing; entries left over from a previous run are replayed first"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._wakeup.set()
+    
+    async def stop(self):
+        """Stop the background task after a last flush attempt"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush_pending()
+        except Exception as e:
+            print(f"Could not flush message journal on shutdown: {e}")
+    
+    async def flush_pending(self) -> int:
+        """Flush batches until the journal is empty; raises if a batch fails"""
+        total = 0
+        while True:
+            batch = await asyncio.to_thread(self.journal.take_batch, self.batch_size)
+            if not batch:
+                return total
+            await self._flush_batch(batch)
+            total += len(batch)
+    
+    async def _flush_batch(self, batch: List[Dict]):
+        seqs = [row["seq"] for row in batch]
+        try:
+            await self.flush([self._row(row) for row in batch])
+        except Exception as e:
+            self.failed_flushes += 1
+            await asyncio.to_thread(self.journal.mark_failed, seqs)
+            if self.is_permanent_error(e):
+                # The database rejected something in the batch: write rows one by one so
+                # only the rejected ones are dropped
+                await self._flush_individually(batch)
+                return
+            # Unreachable or overloaded: keep every row and let the caller back off
+            raise
+        await asyncio.to_thread(self.journal.remove, seqs)
+        self.flushed += len(batch)
+    
+    async def _flush_individually(self, batch: List[Dict]):
+        for row in batch:
+            try:
+                await self.flush([self._row(row)])
+                self.flushed += 1
+            except Exception as e:
+                if not self.is_permanent_error(e):
+                    # The database went away mid-batch; the rest stays journaled for the retry
+                    raise
+                print(f"Dropping message {row['id']} for session {row['session_id']}: {e}")
+                self.dropped += 1
+            await asyncio.to_thread(self.journal.remove, [row["seq"]])
+    
+    @staticmethod
+    def _row(row: Dict) -> Dict:
+        return {key: row[key] for key in ("id", "session_id", "role", "content", "created_at")}
+    
+    async def _run(self):
+        delay = self.flush_interval
+        while True:
+            if delay > self.flush_interval:
+                # Backing off: new messages are journaled but do not trigger an early retry
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            
+            try:
+                await self.flush_pending()
+                delay = self.flush_interval
+            except Exception as e:
+                # Back off exponentially while the database is unreachable
+                delay = min(max(delay, self.flush_interval) * 2, self.max_retry_delay)
+                print(f"Message flush failed, retrying in {delay:.1f}s: {e}")
+    
+    def stats(self) -> Dict:
+        """Journal depth and flush counters"""
+        return {
+            "pending": self.journal.count(),
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,237 @@
+"""
+Shared Google model clients: each model is built once per process and reused, so its
+connection pool (keep-alive, TLS session) is shared by every request, and each model has a
+cap on concurrent calls.
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from langchain_google_genai import ChatGoogleGenerativeAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Raised when a limit is saturated and its waiting queue is full"""
+
+
+class ConcurrencyLimit:
+    """
+    Counting semaphore usable from coroutines (async with) and worker threads (with).
+    With max_waiting set, callers beyond that many waiters are rejected instead of queued.
+    """
+    
+    def __init__(self, limit: int, max_waiting: Optional[int] = None):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self._active = 0
+        self._sync_waiting = 0
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        # Coroutines waiting for a slot; a released slot is handed to them first
+        self._async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self.waited = 0
+        self.rejected = 0
+    
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free right now"""
+        with self._lock:
+            if self._active < self.limit:
+                self._active += 1
+                return True
+            self.rejected += 1
+            return False
+    
+    def is_saturated(self) -> bool:
+        """True when a new caller would be rejected"""
+        with self._lock:
+            return self._active >= self.limit and self._queue_full()
+    
+    def _queue_full(self) -> bool:
+        return self.max_waiting is not None and self._sync_waiting + len(self._async_waiters) >= self.max_waiting
+    
+    def acquire(self):
+        """Block the calling thread until a slot is free"""
+        with self._lock:
+            if self._active >= self.limit:
+                if self._queue_full():
+                    self.rejected += 1
+                    raise ConcurrencyLimitExceeded("Too many calls waiting")
+                self.waited += 1
+                self._sync_waiting += 1
+                try:
+                    while self._active >= self.limit:
+                        self._slot_freed.wait()
+                finally:
+                    self._sync_waiting -= 1
+            self._active += 1
+    
+    async def acquire_async(self):
+        """Wait for a slot without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit:
+                self._active += 1
+                return
+            if self._queue_full():
+                self.rejected += 1
+                raise ConcurrencyLimitExceeded("Too many calls waiting")
+            future = loop.create_future()
+            self._async_waiters.append((loop, future))
+            self.waited += 1
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._async_waiters.remove((loop, future))
+                    return_slot = False
+                except ValueError:
+                    # release() already picked this waiter. If the slot was granted before the
+                    # cancellation, give it back; otherwise the pending grant passes it on.
+                    return_slot = not future.cancelled()
+            if return_slot:
+                self.release()
+            raise
+    
+    def release(self):
+        with self._lock:
+            if self._async_waiters:
+                # Hand the slot straight to the next coroutine; _active stays the same
+                loop, future = self._async_waiters.popleft()
+            else:
+                self._active -= 1
+                self._slot_freed.notify()
+                return
+        loop.call_soon_threadsafe(self._grant_or_release, future)
+    
+    def _grant_or_release(self, future: asyncio.Future):
+        # Runs on the waiter's loop: give it the slot, or pass the slot on if it was cancelled
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        self.release()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "waiting": self._sync_waiting + len(self._async_waiters),
+                "max_waiting": self.max_waiting,
+                "waited": self.waited,
+                "rejected": self.rejected
+            }
+
+
+@dataclass
+class ModelSpec:
+    """How to build one shared model client"""
+    model: str
+    max_concurrency: int
+    # Callers allowed to queue for a slot (None: unbounded)
+    max_waiting: Optional[int] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+# Model names and limits can be overridden per deployment
+MODEL_SPECS: Dict[str, ModelSpec] = {
+    # Chat agent; one slot per agent run
+    "agent": ModelSpec(
+        model=os.getenv("AGENT_MODEL", "gemini-2.5-flash"),
+        max_concurrency=int(os.getenv("AGENT_MODEL_MAX_CONCURRENCY", "32"))
+    ),
+    # Speech-to-text; requests beyond the queue are turned away with 429
+    "asr": ModelSpec(
+        model=os.getenv("ASR_MODEL", "gemini-2.0-flash-lite"),
+        max_concurrency=int(os.getenv("ASR_MODEL_MAX_CONCURRENCY", "8")),
+        max_waiting=int(os.getenv("ASR_MAX_QUEUE", "16"))
+    ),
+    # Optional title refinement; it is skipped rather than queued when all slots are busy
+    "title": ModelSpec(
+        model=os.getenv("TITLE_MODEL", "gemma-3-1b-it"),
+        max_concurrency=int(os.getenv("TITLE_LLM_MAX_IN_FLIGHT", "4")),
+        options={"temperature": 0.2, "timeout": 10, "max_retries": 1}
+    ),
+}
+
+
+class ModelRegistry:
+    """Builds each model client on first use and hands out the same instance afterwards"""
+    
+    def __init__(self, specs: Dict[str, ModelSpec], factory: Optional[Callable[[ModelSpec], Any]] = None):
+        self.specs = specs
+        self.factory = factory or self._build_chat_model
+        self._models: Dict[str, Any] = {}
+        self._limits = {name: ConcurrencyLimit(spec.max_concurrency, spec.max_waiting) for name, spec in specs.items()}
+        self._lock = threading.Lock()
+        self._genai_configured = False
+    
+    def _build_chat_model(self, spec: ModelSpec) -> ChatGoogleGenerativeAI:
+        return ChatGoogleGenerativeAI(
+            model=spec.model,
+            api_key=os.environ.get("GOOGLE_API_KEY"),
+            **spec.options
+        )
+    
+    def get(self, name: str) -> Any:
+        """The shared client for a model name from MODEL_SPECS"""
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._models[name] = self.factory(self.specs[name])
+        return model
+    
+    def limit(self, name: str) -> ConcurrencyLimit:
+        """Concurrency cap for calls to a model"""
+        return self._limits[name]
+    
+    def genai_client(self):
+        """The google.generativeai SDK (Files API), configured with the API key only once"""
+        import google.generativeai as genai
+        
+        with self._lock:
+            if not self._genai_configured:
+                api_key = os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GOOGLE_API_KEY not configured")
+                genai.configure(api_key=api_key)
+                self._genai_configured = True
+        return genai
+    
+    def stats(self) -> Dict:
+        """Which clients are built and how busy each model is"""
+        return {
+            name: {
+                "model": spec.model,
+                "initialized": name in self._models,
+                **self._limits[name].stats()
+            }
+            for name, spec in self.specs.items()
+        }
+
+
+# Global registry instance
+model_registry = ModelRegistry(MODEL_SPECS)
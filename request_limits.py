@@ -0,0 +1,54 @@
+"""
+ASGI middleware that turns away oversized request bodies before they are parsed or buffered.
+"""
+
+from typing import Callable, Iterable, Optional
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+
+class BodySizeLimitMiddleware:
+    """
+    Answers 413 for bodies over max_bytes on the given paths: straight from Content-Length when
+    the client sends one, otherwise as soon as the streamed body passes the limit.
+    """
+    
+    def __init__(self, app, max_bytes: int, paths: Iterable[str], on_reject: Optional[Callable[[], None]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = frozenset(paths)
+        self.on_reject = on_reject
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            self._rejected()
+            response = JSONResponse({"detail": self._detail()}, status_code=413)
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    self._rejected()
+                    # Raised inside form parsing; FastAPI passes HTTPExceptions through as responses
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+        
+        await self.app(scope, limited_receive, send)
+    
+    def _detail(self) -> str:
+        return f"Request body exceeds the {self.max_bytes // (1024 * 1024)} MB limit"
+    
+    def _rejected(self):
+        if self.on_reject is not None:
+            self.on_reject()
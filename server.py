@@ -1,23 +1,58 @@
-from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Form, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
+import asyncio
 import os
+import json
 import mimetypes
-import tempfile
-import time
 from pathlib import Path
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from main import create_agent_with_memory
 from supabase_session_manager import supabase_session_manager
-from session_manager import SessionManager
-import google.generativeai as genai
+from session_manager import SessionManager, SessionExpiryService
+from session_store import create_session_store
+from session_locks import SessionLockTable, SessionBusyError, TurnCoalescer
+from title_jobs import TitleJobQueue
+from title_generator import generate_local_title, refine_chat_title
 from auth_service import auth_service, get_current_user_dependency
+from model_registry import model_registry
+from asr import asr_service, AudioTooLargeError, ASRBusyError
+from tools.weather_data import weather_cache
+from request_limits import BodySizeLimitMiddleware
+
+# Initialize in-memory session manager for anonymous users or when DB is unavailable.
+# SESSION_STORE picks what sits behind RAM:
+#   spill  - sessions leaving RAM spill to a local SQLite file (default)
+#   sqlite - SQLite file shared by all workers on this host (WAL mode)
+#   redis  - Redis-protocol server shared by all workers and hosts (REDIS_URL)
+#   memory - RAM only
+session_store_backend = os.getenv("SESSION_STORE", "spill")
+in_memory_session_manager = SessionManager(
+    max_sessions=int(os.getenv("SESSION_MAX_IN_MEMORY", "100000")),
+    # Approximate bytes of message text (plus overhead) held in RAM across all sessions
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES_IN_MEMORY", str(256 * 1024 * 1024))),
+    store=create_session_store(
+        session_store_backend,
+        path=os.getenv("SESSION_STORE_PATH", str(Path(__file__).parent / ".data" / "sessions.db")),
+        redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        max_sessions=int(os.getenv("SESSION_STORE_MAX_SESSIONS", "1000000")),
+        max_age_seconds=float(os.getenv("SESSION_STORE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+    ),
+    shared_store=session_store_backend in ("sqlite", "redis")
+)
 
-# Initialize in-memory session manager for anonymous users or when DB is unavailable
-in_memory_session_manager = SessionManager()
+# Background expiry of idle in-memory sessions
+session_expiry_service = SessionExpiryService(
+    in_memory_session_manager,
+    max_idle_seconds=float(os.getenv("SESSION_IDLE_TTL_SECONDS", str(24 * 3600))),
+    interval_seconds=float(os.getenv("SESSION_EXPIRY_INTERVAL_SECONDS", "60"))
+)
 
 # Optional auth dependency for endpoints that can work without auth
 async def get_optional_user(authorization: str = Header(None)) -> Optional[dict]:
@@ -36,7 +71,61 @@ async def get_optional_user(authorization: str = Header(None)) -> Optional[dict]
 mimetypes.add_type('text/css', '.css')
 mimetypes.add_type('application/javascript', '.js')
 
-app = FastAPI(title="Kheti - Agricultural AI Assistant", description="AI-powered agricultural assistant for Indian farmers")
+# Write-behind message persistence: messages are journaled locally and flushed to Supabase
+# in the background (set MESSAGE_WRITE_BEHIND=false to write synchronously)
+if os.getenv("MESSAGE_WRITE_BEHIND", "true").lower() in ("1", "true", "yes"):
+    supabase_session_manager.enable_write_behind(
+        os.getenv("MESSAGE_JOURNAL_PATH", str(Path(__file__).parent / ".data" / "message_journal.db")),
+        batch_size=int(os.getenv("MESSAGE_FLUSH_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("MESSAGE_FLUSH_INTERVAL_SECONDS", "0.5"))
+    )
+
+# Serialize turns per session; optionally share one agent run between identical in-flight turns
+session_locks = SessionLockTable(
+    max_sessions=int(os.getenv("CHAT_LOCK_MAX_SESSIONS", "10000")),
+    max_waiters_per_session=int(os.getenv("CHAT_LOCK_MAX_WAITERS", "4"))
+)
+turn_coalescer = TurnCoalescer()
+CHAT_COALESCE_DUPLICATES = os.getenv("CHAT_COALESCE_DUPLICATES", "true").lower() in ("1", "true", "yes")
+
+# Session titles are generated in the background after the response; clients poll
+# GET /chat/sessions/{id}/title or get a `title` event at the end of /chat/stream
+title_jobs = TitleJobQueue()
+TITLE_STREAM_WAIT_SECONDS = float(os.getenv("TITLE_STREAM_WAIT_SECONDS", "10"))
+
+# Size of the worker pool that runs blocking work (sync tools, memory writes, title generation)
+AGENT_WORKER_THREADS = int(os.getenv("AGENT_WORKER_THREADS", "32"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Install a bounded worker pool and run background services for the app's lifetime"""
+    executor = ThreadPoolExecutor(max_workers=AGENT_WORKER_THREADS, thread_name_prefix="agent-worker")
+    asyncio.get_running_loop().set_default_executor(executor)
+    session_expiry_service.start()
+    if supabase_session_manager.persister is not None:
+        supabase_session_manager.persister.start()
+    yield
+    await title_jobs.drain(timeout=5)
+    if supabase_session_manager.persister is not None:
+        await supabase_session_manager.persister.stop()
+    await session_expiry_service.stop()
+    executor.shutdown(wait=False)
+
+app = FastAPI(
+    title="Kheti - Agricultural AI Assistant",
+    description="AI-powered agricultural assistant for Indian farmers",
+    lifespan=lifespan
+)
+
+# Reject oversized audio uploads before they are parsed (room is left for multipart framing)
+AUDIO_UPLOAD_PATHS = ("/asr/transcribe", "/chat/transcribe", "/chat/voice")
+AUDIO_READ_CHUNK_BYTES = 64 * 1024
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=asr_service.max_audio_bytes + 64 * 1024,
+    paths=AUDIO_UPLOAD_PATHS,
+    on_reject=asr_service.count_rejected_too_large
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -134,24 +223,52 @@ async def auth_callback():
     return RedirectResponse(url="/?auth=success")
 
 # ASR (Speech-to-Text) Endpoint
+async def read_audio_upload(audio: UploadFile) -> bytes:
+    """Read an uploaded recording in chunks, stopping as soon as it is over the size limit"""
+    too_large = AudioTooLargeError(f"Audio exceeds the {asr_service.max_audio_bytes // (1024 * 1024)} MB limit")
+    if audio.size is not None and audio.size > asr_service.max_audio_bytes:
+        asr_service.count_rejected_too_large()
+        raise too_large
+    
+    chunks = []
+    total = 0
+    while True:
+        chunk = await audio.read(AUDIO_READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > asr_service.max_audio_bytes:
+            asr_service.count_rejected_too_large()
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def asr_http_exception(e: Exception) -> HTTPException:
+    """Map ASR admission errors to 413 (too large) or 429 (busy, with Retry-After)"""
+    if isinstance(e, AudioTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 @app.post("/asr/transcribe")
 async def transcribe_audio_endpoint(audio: UploadFile = File(...)):
     """Transcribe audio file using Gemini ASR with structured output"""
     try:
-        # Read the uploaded audio file
-        audio_data = await audio.read()
+        # Read the uploaded audio file (bounded, kept in memory, never written to disk)
+        audio_data = await read_audio_upload(audio)
+        mime_type = audio.content_type or "audio/webm"
         
-        # Import the ASR module
-        from asr import transcribe_audio
+        # Turn the request away before any model call if the ASR queue is full
+        # (clips already transcribed or in flight are still answered)
+        await asr_service.check_capacity(audio_data, mime_type)
         
-        # Get transcription using LangChain structured output
-        transcription = transcribe_audio(
-            audio_data=audio_data,
-            mime_type=audio.content_type or "audio/webm"
-        )
+        transcription = await asr_service.transcribe(audio_data, mime_type)
         
         return {"transcription": transcription, "success": True}
     
+    except (AudioTooLargeError, ASRBusyError) as e:
+        raise asr_http_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error transcribing audio: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error transcribing audio: {str(e)}")
@@ -269,27 +386,16 @@ async def fork_session(
             if not original_session["is_public"]:
                 raise HTTPException(status_code=403, detail="Cannot fork private sessions")
         
-        # Get original messages
-        original_messages = await supabase_session_manager.get_messages(session_id)
-        
         # Create new session
         if current_user:
-            # Authenticated user - create persistent session
+            # Authenticated user - copy the session and its messages server-side in one call
             try:
-                new_session_id = await supabase_session_manager.create_session(
+                new_session_id = await supabase_session_manager.fork_session(
+                    session_id,
                     user_id=current_user["id"],
-                    title=f"Fork of {original_session['title']}",
-                    is_public=False  # Forked sessions are private by default
+                    title=f"Fork of {original_session['title']}"
                 )
                 
-                # Copy all messages to new session
-                for msg in original_messages:
-                    await supabase_session_manager.add_message(
-                        new_session_id,
-                        msg["role"],
-                        msg["content"]
-                    )
-                
                 return {
                     "session_id": new_session_id,
                     "message": "Session forked successfully",
@@ -305,13 +411,12 @@ async def fork_session(
             import uuid
             new_session_id = f"anon-{str(uuid.uuid4())}"
         
-        # For temporary/anonymous sessions, copy messages to in-memory
-        _, memory = in_memory_session_manager.get_or_create_session(new_session_id)
-        for msg in original_messages:
-            if msg["role"] == "user":
-                memory.chat_memory.add_user_message(msg["content"])
-            else:
-                memory.chat_memory.add_ai_message(msg["content"])
+        # For temporary/anonymous sessions, load the messages the memory window can hold in one pass
+        original_messages = await supabase_session_manager.get_messages(
+            session_id,
+            limit=in_memory_session_manager.memory_window * 2
+        )
+        await in_memory_session_manager.aimport_messages(new_session_id, original_messages)
         
         return {
             "session_id": new_session_id,
@@ -324,6 +429,23 @@ async def fork_session(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error forking session: {str(e)}")
 
+@app.get("/chat/sessions/{session_id}/title")
+async def get_session_title(
+    session_id: str,
+    current_user: dict = Depends(get_current_user_dependency)
+):
+    """Poll for a session's title; `pending` is true while it may still be replaced by a generated one"""
+    try:
+        session = await supabase_session_manager.get_session(session_id, user_id=current_user["id"])
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        return {"session_id": session_id, "title": session["title"], "pending": title_jobs.is_pending(session_id)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching session title: {str(e)}")
+
 @app.patch("/chat/sessions/{session_id}")
 async def update_session(
     session_id: str,
@@ -371,6 +493,138 @@ async def delete_session(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting session: {str(e)}")
 
+async def prepare_chat_turn(request: ChatRequest, current_user: Optional[dict]):
+    """
+    Resolve the session for a chat turn and return (session_id, memory, use_database, title).
+    Creates a new session when none is given; title is None for in-memory sessions.
+    """
+    session_id = request.session_id
+    use_database = False
+    title = None
+    
+    # If no session_id provided, create a new one
+    if not session_id:
+        if current_user:
+            # Authenticated user - try to create persistent session
+            try:
+                session_id = await supabase_session_manager.create_session(
+                    user_id=current_user["id"],
+                    title="New Chat"
+                )
+                use_database = True
+                title = "New Chat"
+            except Exception as e:
+                print(f"Could not create database session, using in-memory: {e}")
+                # Fallback to in-memory session
+                import uuid
+                session_id = f"temp-{str(uuid.uuid4())}"
+                use_database = False
+        else:
+            # Anonymous user - create temporary session
+            import uuid
+            session_id = f"anon-{str(uuid.uuid4())}"
+            use_database = False
+    else:
+        # Check if this is a persistent session or temporary
+        if current_user and not (session_id.startswith("anon-") or session_id.startswith("temp-")):
+            # Try to use database
+            try:
+                session = await supabase_session_manager.get_session(session_id, current_user["id"])
+                if session:
+                    use_database = True
+                    title = session["title"]
+                else:
+                    raise HTTPException(status_code=403, detail="Access denied to this session")
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"Could not access database session, using in-memory: {e}")
+                use_database = False
+    
+    # Get or create memory for this session
+    if use_database:
+        # Authenticated user with persistent session - use database
+        try:
+            memory = await supabase_session_manager.get_or_create_memory(session_id)
+        except Exception as e:
+            print(f"Database error, falling back to in-memory: {e}")
+            use_database = False
+            _, memory = await in_memory_session_manager.aget_or_create_session(session_id)
+    
+    if not use_database:
+        # Anonymous user or temporary session - use in-memory only
+        _, memory = await in_memory_session_manager.aget_or_create_session(session_id)
+    
+    return session_id, memory, use_database, title
+
+async def finish_chat_turn(
+    session_id: str,
+    text: str,
+    output: str,
+    current_user: Optional[dict],
+    use_database: bool,
+    title: Optional[str]
+) -> Optional[str]:
+    """
+    Save the turn for database sessions and return the session title.
+    A session still called "New Chat" gets an instant local title, which is returned and
+    stored (and optionally refined by the LLM) in the background.
+    """
+    if not use_database:
+        return None
+    
+    # Save user message and assistant response together (only for database sessions)
+    try:
+        await supabase_session_manager.add_messages(session_id, [
+            {"role": "user", "content": text},
+            {"role": "assistant", "content": output}
+        ])
+    except Exception as e:
+        print(f"Could not save to database: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    if title == "New Chat":
+        local_title = generate_local_title(text)
+        # Runs after the response; a job already running for this session is reused
+        title_jobs.schedule(session_id, lambda: generate_title(session_id, current_user["id"], text, local_title))
+        return local_title
+    
+    return title
+
+async def generate_title(session_id: str, user_id: str, first_message: str, local_title: str) -> Optional[str]:
+    """
+    Title job: store the local title, then replace it with the LLM's title when refinement
+    runs. A title the user set meanwhile (or another worker wrote) is never overwritten.
+    """
+    if not await supabase_session_manager.set_generated_title(session_id, user_id, local_title):
+        session = await supabase_session_manager.get_session(session_id, user_id)
+        return session["title"] if session else None
+    
+    # None when refinement is disabled or too many title calls are running
+    refined_title = await asyncio.to_thread(refine_chat_title, first_message)
+    print(f"Title for session {session_id}: {local_title!r} -> {refined_title!r}")
+    
+    if refined_title and refined_title != local_title:
+        if await supabase_session_manager.set_generated_title(session_id, user_id, refined_title, expected=local_title):
+            return refined_title
+    return local_title
+
+def format_sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def chunk_text(chunk) -> str:
+    """Extract the text of a streamed chat model chunk"""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    # Some providers stream a list of content parts
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part)
+        for part in content
+    )
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -380,171 +634,230 @@ async def chat(
     Chat endpoint - works with or without authentication.
     - Authenticated users: Sessions saved to database (if available)
     - Anonymous users: Sessions are temporary (in-memory only)
+    Turns for the same session run one at a time; identical concurrent turns can share one run.
     """
+    if CHAT_COALESCE_DUPLICATES and request.session_id:
+        key = (current_user["id"] if current_user else None, request.session_id, request.text)
+        return await turn_coalescer.run(key, lambda: run_chat_turn(request, current_user))
+    
+    return await run_chat_turn(request, current_user)
+
+async def run_chat_turn(request: ChatRequest, current_user: Optional[dict]) -> ChatResponse:
+    """Run one chat turn, holding the session's lock for its whole duration"""
     try:
-        session_id = request.session_id
-        use_database = False
-        
-        # If no session_id provided, create a new one
-        if not session_id:
-            if current_user:
-                # Authenticated user - try to create persistent session
-                try:
-                    session_id = await supabase_session_manager.create_session(
-                        user_id=current_user["id"],
-                        title="New Chat"
-                    )
-                    use_database = True
-                except Exception as e:
-                    print(f"Could not create database session, using in-memory: {e}")
-                    # Fallback to in-memory session
-                    import uuid
-                    session_id = f"temp-{str(uuid.uuid4())}"
-                    use_database = False
-            else:
-                # Anonymous user - create temporary session
-                import uuid
-                session_id = f"anon-{str(uuid.uuid4())}"
-                use_database = False
-        else:
-            # Check if this is a persistent session or temporary
-            if current_user and not (session_id.startswith("anon-") or session_id.startswith("temp-")):
-                # Try to use database
-                try:
-                    session = await supabase_session_manager.get_session(session_id, current_user["id"])
-                    if session:
-                        use_database = True
-                    else:
-                        raise HTTPException(status_code=403, detail="Access denied to this session")
-                except HTTPException:
-                    raise
-                except Exception as e:
-                    print(f"Could not access database session, using in-memory: {e}")
-                    use_database = False
-        
-        # Get or create memory for this session
-        if use_database:
-            # Authenticated user with persistent session - use database
-            try:
-                memory = await supabase_session_manager.get_or_create_memory(session_id)
-                await supabase_session_manager.add_message(session_id, "user", request.text)
-            except Exception as e:
-                print(f"Database error, falling back to in-memory: {e}")
-                use_database = False
-                _, memory = in_memory_session_manager.get_or_create_session(session_id)
-        
-        if not use_database:
-            # Anonymous user or temporary session - use in-memory only
-            _, memory = in_memory_session_manager.get_or_create_session(session_id)
-        
-        # Generate response
-        agent_executor = create_agent_with_memory(memory)
-        response = agent_executor.invoke({"text": request.text})
-        
-        generated_title = None
-        
-        # Save assistant response (only for database sessions)
-        if use_database:
-            try:
-                await supabase_session_manager.add_message(session_id, "assistant", response["output"])
-                
-                # Auto-generate title from first message if still "New Chat"
-                session = await supabase_session_manager.get_session(session_id, current_user["id"])
-                print(f"Session after response: {session}")
-                
-                if session and session["title"] == "New Chat":
-                    print(f"Generating title for session {session_id}...")
-                    new_title = await supabase_session_manager.generate_session_title(session_id)
-                    print(f"Generated title: {new_title}")
-                    
-                    await supabase_session_manager.update_session(session_id, current_user["id"], title=new_title)
-                    generated_title = new_title
-                else:
-                    generated_title = session.get("title") if session else None
-                    
-            except Exception as e:
-                print(f"Could not save to database or generate title: {e}")
-                import traceback
-                traceback.print_exc()
+        lock = session_locks.hold(request.session_id) if request.session_id else nullcontext()
+        async with lock:
+            session_id, memory, use_database, title = await prepare_chat_turn(request, current_user)
+            
+            # Generate response (async end to end; sync tools run in the worker pool)
+            agent_executor = create_agent_with_memory(memory)
+            async with model_registry.limit("agent"):
+                response = await agent_executor.ainvoke({"text": request.text})
+            
+            title = await finish_chat_turn(session_id, request.text, response["output"], current_user, use_database, title)
         
         return ChatResponse(
             output=response["output"],
             session_id=session_id,
-            title=generated_title
+            title=title
         )
     
     except HTTPException:
         raise
+    except SessionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
-@app.post("/chat/transcribe")
-async def transcribe_audio(audio: UploadFile = File(...)):
-    """Transcribe audio to text using Gemini"""
+async def lock_chat_turn(turn: AsyncExitStack, session_id: Optional[str]):
+    """Hold the session's turn lock until `turn` is closed (nothing to lock for a session not created yet)"""
+    if session_id:
+        await turn.enter_async_context(session_locks.hold(session_id))
+
+async def stream_chat_turn(
+    request: ChatRequest,
+    current_user: Optional[dict],
+    turn: AsyncExitStack,
+    session_id: str,
+    memory,
+    use_database: bool,
+    title: Optional[str]
+):
+    """
+    Run a prepared chat turn and yield its SSE frames (shared by /chat/stream and /chat/voice).
+    `turn` holds the session lock taken before the memory was loaded; it is released as soon
+    as the turn is saved.
+    """
+    agent_executor = create_agent_with_memory(memory)
+    
+    yield format_sse_event("session", {"session_id": session_id})
+    
     try:
-        # Configure Gemini API
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="GOOGLE_API_KEY not configured")
-        
-        genai.configure(api_key=api_key)
-        
-        # Read the audio file
-        audio_data = await audio.read()
-        
-        if len(audio_data) == 0:
-            raise HTTPException(status_code=400, detail="Empty audio file received")
-        
-        # Save to temporary file with proper extension
-        suffix = ".webm" if audio.content_type == "audio/webm" else ".wav"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_audio:
-            temp_audio.write(audio_data)
-            temp_audio_path = temp_audio.name
-        
-        try:
-            # Upload the audio file to Gemini
-            print(f"Uploading audio file: {temp_audio_path}, size: {len(audio_data)} bytes")
-            audio_file = genai.upload_file(temp_audio_path)
-            
-            # Wait for file to be processed
-            while audio_file.state.name == "PROCESSING":
-                time.sleep(0.5)
-                audio_file = genai.get_file(audio_file.name)
-            
-            if audio_file.state.name == "FAILED":
-                raise Exception("Audio file processing failed")
-            
-            # Use Gemini to transcribe
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            prompt = "Transcribe the speech in this audio file. Return ONLY the transcribed text without any additional commentary, formatting, or explanations."
-            
-            response = model.generate_content([prompt, audio_file])
-            transcribed_text = response.text.strip()
+        async with model_registry.limit("agent"):
+            output = None
+            async for event in agent_executor.astream_events({"text": request.text}, version="v2"):
+                kind = event["event"]
+                
+                if kind == "on_chat_model_stream":
+                    token = chunk_text(event["data"]["chunk"])
+                    if token:
+                        yield format_sse_event("token", {"text": token})
+                elif kind == "on_tool_start":
+                    yield format_sse_event("tool_start", {"name": event["name"], "input": event["data"].get("input")})
+                elif kind == "on_tool_end":
+                    yield format_sse_event("tool_end", {"name": event["name"]})
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    # End of the root AgentExecutor run carries the final answer
+                    output = event["data"]["output"]["output"]
             
-            # Delete the uploaded file from Gemini
-            genai.delete_file(audio_file.name)
+            if output is None:
+                raise RuntimeError("Agent finished without producing an output")
             
-            print(f"Transcription successful: {transcribed_text[:100]}...")
+            current_title = await finish_chat_turn(session_id, request.text, output, current_user, use_database, title)
             
-            return {
-                "transcription": transcribed_text,
-                "success": True
-            }
-        
-        except Exception as inner_error:
-            print(f"Inner error during transcription: {str(inner_error)}")
-            raise HTTPException(status_code=500, detail=f"Transcription failed: {str(inner_error)}")
-        
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
-    
+            yield format_sse_event("done", {
+                "output": output,
+                "session_id": session_id,
+                "title": current_title
+            })
+        
+        # The turn is saved; let the next one for this session start
+        await turn.aclose()
+        
+        # The answer is complete; keep the stream open briefly to deliver the new title
+        if title_jobs.is_pending(session_id):
+            new_title = await title_jobs.wait(session_id, TITLE_STREAM_WAIT_SECONDS)
+            if new_title:
+                yield format_sse_event("title", {"session_id": session_id, "title": new_title})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error transcribing audio: {str(e)}")
+        print(f"Error in chat stream: {e}")
+        import traceback
+        traceback.print_exc()
+        yield format_sse_event("error", {"detail": f"Error processing request: {str(e)}"})
+
+def sse_response(events, turn: Optional[AsyncExitStack] = None) -> StreamingResponse:
+    """
+    Wrap an async generator of SSE frames in an unbuffered streaming response. `turn` (the
+    held session lock) is released when the stream ends, or after the response if the client
+    left before the stream started.
+    """
+    if turn is not None:
+        events = release_after(events, turn)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(turn.aclose) if turn is not None else None
+    )
+
+async def release_after(events, turn: AsyncExitStack):
+    try:
+        async for frame in events:
+            yield frame
+    finally:
+        await turn.aclose()
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    current_user: Optional[dict] = Depends(get_optional_user)
+):
+    """
+    Streaming chat endpoint using Server-Sent Events.
+    Emits `session`, `tool_start`, `tool_end` and `token` events while the agent runs,
+    then a `done` event with the full output (or an `error` event). For a new session a
+    `title` event with the final title follows once the background title job finishes.
+    """
+    # Lock the session before its memory is loaded, so a queued turn sees the one before it
+    turn = AsyncExitStack()
+    try:
+        await lock_chat_turn(turn, request.session_id)
+        session_id, memory, use_database, title = await prepare_chat_turn(request, current_user)
+        if not request.session_id:
+            await lock_chat_turn(turn, session_id)
+    except SessionBusyError as e:
+        await turn.aclose()
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        await turn.aclose()
+        raise
+    except Exception as e:
+        await turn.aclose()
+        print(f"Error in chat stream endpoint: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    
+    return sse_response(stream_chat_turn(request, current_user, turn, session_id, memory, use_database, title), turn)
+
+@app.post("/chat/voice")
+async def chat_voice(
+    audio: UploadFile = File(...),
+    session_id: Optional[str] = Form(None),
+    current_user: Optional[dict] = Depends(get_optional_user)
+):
+    """
+    Voice chat endpoint: transcribe the audio, answer it and stream both in one request.
+    Emits a `transcript` event first, then the same events as /chat/stream. The turn is saved
+    like a typed message.
+    """
+    mime_type = audio.content_type or "audio/webm"
+    try:
+        audio_data = await read_audio_upload(audio)
+        if not audio_data:
+            raise HTTPException(status_code=400, detail="Empty audio file received")
+        asr_service.check_audio(audio_data)
+        await asr_service.check_capacity(audio_data, mime_type)
+    except (AudioTooLargeError, ASRBusyError) as e:
+        raise asr_http_exception(e)
+    
+    # The turn lock is held from before transcription until the turn is saved
+    turn = AsyncExitStack()
+    try:
+        await lock_chat_turn(turn, session_id)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    async def event_stream():
+        try:
+            text = await asr_service.transcribe(audio_data, mime_type)
+        except ASRBusyError as e:
+            # The queue filled up between admission and transcription
+            yield format_sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            print(f"Error transcribing audio: {str(e)}")
+            yield format_sse_event("error", {"detail": f"Error transcribing audio: {str(e)}"})
+            return
+        
+        yield format_sse_event("transcript", {"text": text})
+        if not text:
+            yield format_sse_event("error", {"detail": "No speech detected"})
+            return
+        
+        request = ChatRequest(text=text, session_id=session_id)
+        try:
+            prepared = await prepare_chat_turn(request, current_user)
+            if not session_id:
+                await lock_chat_turn(turn, prepared[0])
+        except HTTPException as e:
+            yield format_sse_event("error", {"detail": e.detail})
+            return
+        except Exception as e:
+            print(f"Error in voice chat endpoint: {e}")
+            yield format_sse_event("error", {"detail": f"Error processing request: {str(e)}"})
+            return
+        
+        async for frame in stream_chat_turn(request, current_user, turn, *prepared):
+            yield frame
+    
+    return sse_response(event_stream(), turn)
+
+@app.post("/chat/transcribe")
+async def transcribe_audio(audio: UploadFile = File(...)):
+    """Transcribe audio to text using Gemini (alias of /asr/transcribe)"""
+    return await transcribe_audio_endpoint(audio)
 
 # Deprecated endpoints (kept for backwards compatibility)
 @app.post("/chat/new-session")
@@ -589,6 +902,25 @@ async def serve_frontend():
 async def health_check():
     return {"status": "healthy", "service": "Kheti - Agricultural AI Assistant"}
 
+@app.get("/health/stats")
+async def health_stats():
+    """Cache and session counters for monitoring"""
+    return {
+        "memory_cache": supabase_session_manager.get_cache_stats(),
+        "message_journal": supabase_session_manager.persister.stats() if supabase_session_manager.persister else None,
+        "anonymous_sessions": in_memory_session_manager.get_stats(),
+        "session_expiry": session_expiry_service.stats(),
+        "chat_turns": {
+            "locked_sessions": len(session_locks),
+            "in_flight_coalesced": len(turn_coalescer),
+            "coalesced_total": turn_coalescer.coalesced
+        },
+        "title_jobs": title_jobs.stats(),
+        "models": model_registry.stats(),
+        "asr": asr_service.stats(),
+        "weather_cache": weather_cache.stats()
+    }
+
 # Catch-all route for React Router (SPA routing) - MUST be last
 @app.get("/{path:path}")
 async def serve_spa(path: str):
@@ -0,0 +1,71 @@
+"""
+Per-session serialization of chat turns, with optional coalescing of duplicate in-flight turns.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SessionBusyError(Exception):
+    """Raised when a session (or the whole lock table) has too many turns waiting"""
+
+
+class SessionLockTable:
+    """Async locks keyed by session id, created on demand and dropped once no turn holds or awaits them"""
+    
+    def __init__(self, max_sessions: int = 10000, max_waiters_per_session: int = 4):
+        self.max_sessions = max_sessions
+        self.max_waiters_per_session = max_waiters_per_session
+        # session_id -> [lock, number of turns holding or waiting for it]
+        self._locks: Dict[str, List[Any]] = {}
+    
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        """Run the enclosed block exclusively for session_id"""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            if len(self._locks) >= self.max_sessions:
+                raise SessionBusyError("Too many concurrent chat sessions")
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        elif entry[1] >= self.max_waiters_per_session:
+            raise SessionBusyError("Too many pending messages for this session")
+        
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+    
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class TurnCoalescer:
+    """Shares one run between identical requests that are in flight at the same time"""
+    
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+    
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the in-flight run for key, or start one with factory()"""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        
+        # Shield so one caller disconnecting does not cancel the run for the others
+        return await asyncio.shield(task)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._in_flight
+    
+    def __len__(self) -> int:
+        return len(self._in_flight)
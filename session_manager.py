@@ -1,62 +1,304 @@
 import uuid
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from langchain.memory import ConversationBufferWindowMemory
-from langchain.schema import BaseMessage
+from langchain.schema import BaseMessage, HumanMessage, AIMessage
+from langchain_core.chat_history import BaseChatMessageHistory
 from collections import OrderedDict
+from session_store import SessionStore, StoredSession
+import asyncio
+import heapq
 import time
 
+# Rough fixed costs of a session record and of one stored turn, on top of the message text
+RECORD_OVERHEAD_BYTES = 350
+TURN_OVERHEAD_BYTES = 120
+
+def turns_size(turns: List[Tuple[str, str]]) -> int:
+    """Approximate bytes held by a record's turns"""
+    return sum(TURN_OVERHEAD_BYTES + len(content) * 2 for _, content in turns)
+
+class SessionRecord:
+    """Compact per-session state: a bounded buffer of recent (role, content) turns"""
+    
+    __slots__ = ("turns", "created_at", "last_accessed", "heap_ts", "size")
+    
+    def __init__(self, now: float):
+        self.turns: List[Tuple[str, str]] = []
+        self.created_at = now
+        self.last_accessed = now
+        # last_accessed value of this record's live entry in the expiry heap
+        self.heap_ts = now
+        # Approximate bytes held, counted against the manager's max_bytes
+        self.size = RECORD_OVERHEAD_BYTES
+    
+    def measure(self) -> int:
+        """Re-measure after the turns changed and return the change in size"""
+        size = RECORD_OVERHEAD_BYTES + turns_size(self.turns)
+        delta, self.size = size - self.size, size
+        return delta
+
+class RingBufferHistory(BaseChatMessageHistory):
+    """LangChain chat history view over a SessionRecord, keeping only the last max_messages turns"""
+    
+    def __init__(
+        self,
+        record: SessionRecord,
+        max_messages: int,
+        on_change: Optional[Callable[[SessionRecord], None]] = None,
+        on_resize: Optional[Callable[[int], None]] = None
+    ):
+        self.record = record
+        self.max_messages = max_messages
+        self.on_change = on_change
+        self.on_resize = on_resize
+    
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return [
+            HumanMessage(content=content) if role == "user" else AIMessage(content=content)
+            for role, content in self.record.turns
+        ]
+    
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self._append(messages)
+        if self.on_change is not None:
+            self.on_change(self.record)
+    
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        # The agent saves turns through this; only the store write goes to a worker thread
+        self._append(messages)
+        if self.on_change is not None:
+            await asyncio.to_thread(self.on_change, self.record)
+    
+    def _append(self, messages: Sequence[BaseMessage]):
+        turns = self.record.turns
+        turns.extend(
+            ("user" if isinstance(msg, HumanMessage) else "assistant", msg.content)
+            for msg in messages
+        )
+        # Drop the oldest turns so the buffer never exceeds its capacity
+        if len(turns) > self.max_messages:
+            del turns[:-self.max_messages]
+        self._resized()
+    
+    def _resized(self):
+        delta = self.record.measure()
+        if self.on_resize is not None:
+            self.on_resize(delta)
+    
+    def clear(self) -> None:
+        self.record.turns.clear()
+        self._resized()
+        if self.on_change is not None:
+            self.on_change(self.record)
+    
+    async def aclear(self) -> None:
+        self.record.turns.clear()
+        self._resized()
+        if self.on_change is not None:
+            await asyncio.to_thread(self.on_change, self.record)
+
 class SessionManager:
     """Manages chat sessions with memory for agricultural assistant"""
     
-    def __init__(self, max_sessions: int = 25, memory_window: int = 10):
+    def __init__(
+        self,
+        max_sessions: int = 100_000,
+        memory_window: int = 10,
+        store: Optional[SessionStore] = None,
+        shared_store: bool = False,
+        max_bytes: Optional[int] = None
+    ):
         self.max_sessions = max_sessions
         self.memory_window = memory_window
-        self.sessions: OrderedDict[str, Dict] = OrderedDict()
+        self.sessions: OrderedDict[str, SessionRecord] = OrderedDict()
+        # Optional budget for the approximate bytes of all sessions in RAM; least recently used
+        # sessions leave RAM (to the store, if any) when it is exceeded
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # Optional store behind RAM. As a spill tier, sessions evicted or expired from RAM are written
+        # there and reloaded on demand. As a shared store (several workers), every change is written
+        # through and every access re-reads it, so any worker can continue any session.
+        self.store = store
+        self.shared_store = shared_store and store is not None
+        self.spilled = 0
+        self.reloaded = 0
+        # Sessions evicted from RAM whose spill write is still running
+        self._spilling: Dict[str, SessionRecord] = {}
+        # Min-heap of (last_accessed snapshot, session_id); stale entries are skipped lazily
+        self._expiry_heap: List[Tuple[float, str]] = []
+    
+    def _build_memory(self, session_id: str, record: SessionRecord) -> ConversationBufferWindowMemory:
+        """Build a LangChain memory view on demand; writes go straight into the record"""
+        return ConversationBufferWindowMemory(
+            k=self.memory_window,
+            memory_key="chat_history",
+            return_messages=True,
+            chat_memory=RingBufferHistory(
+                record,
+                self.memory_window * 2,
+                on_change=(lambda changed: self._write_through(session_id, changed)) if self.shared_store else None,
+                on_resize=lambda delta: self._resized(session_id, record, delta)
+            )
+        )
     
     def get_or_create_session(self, session_id: Optional[str] = None) -> tuple[str, ConversationBufferWindowMemory]:
-        """Get existing session or create new one"""
-        
-        if session_id and session_id in self.sessions:
+        """
+        Get existing session or create new one. Store reads and writes run inline; on the
+        event loop use aget_or_create_session instead.
+        """
+        stored = self._load_stored(session_id) if self._needs_load(session_id) else None
+        session_id, record, evicted = self._get_or_create(session_id, stored)
+        self._spill(evicted)
+        return session_id, self._build_memory(session_id, record)
+    
+    async def aget_or_create_session(self, session_id: Optional[str] = None) -> tuple[str, ConversationBufferWindowMemory]:
+        """Get existing session or create new one, with store reads and writes in a worker thread"""
+        stored = await asyncio.to_thread(self._load_stored, session_id) if self._needs_load(session_id) else None
+        session_id, record, evicted = self._get_or_create(session_id, stored)
+        if evicted:
+            await self._aspill(evicted)
+        return session_id, self._build_memory(session_id, record)
+    
+    def _needs_load(self, session_id: Optional[str]) -> bool:
+        if self.store is None or not session_id or session_id in self._spilling:
+            return False
+        # Another worker may have advanced a shared session; a spilled one is only in the store
+        return self.shared_store or session_id not in self.sessions
+    
+    def _get_or_create(self, session_id: Optional[str], stored: Optional[StoredSession]) -> Tuple[str, SessionRecord, List[Tuple[str, SessionRecord]]]:
+        """Find or create the record (applying stored history) and return it with any evicted sessions"""
+        record = self.sessions.get(session_id) if session_id else None
+        if record is not None:
+            if stored is not None:
+                self._apply_stored(record, stored)
+                self.total_bytes += record.measure()
             # Update last accessed time
-            self.sessions[session_id]["last_accessed"] = time.time()
+            record.last_accessed = time.time()
             self.sessions.move_to_end(session_id)
-            return session_id, self.sessions[session_id]["memory"]
+            # Sessions grow between accesses; the budget is enforced here
+            return session_id, record, self._evict_over_budget()
         
         # Create new session
         if not session_id:
             session_id = str(uuid.uuid4())
         
         # Remove oldest session if we exceed max_sessions
+        evicted = []
         if len(self.sessions) >= self.max_sessions:
-            oldest_session = next(iter(self.sessions))
-            del self.sessions[oldest_session]
-        
-        # Create new memory for this session
-        memory = ConversationBufferWindowMemory(
-            k=self.memory_window,
-            memory_key="chat_history",
-            return_messages=True
-        )
+            evicted.append(self._pop_oldest())
         
-        self.sessions[session_id] = {
-            "memory": memory,
-            "created_at": time.time(),
-            "last_accessed": time.time()
-        }
+        # A session evicted a moment ago may still be on its way to the store
+        record = self._spilling.get(session_id) or SessionRecord(time.time())
+        record.last_accessed = time.time()
+        if stored is not None:
+            self._apply_stored(record, stored)
+        record.measure()
+        self.sessions[session_id] = record
+        self.total_bytes += record.size
+        record.heap_ts = record.last_accessed
+        heapq.heappush(self._expiry_heap, (record.heap_ts, session_id))
+        self._compact_expiry_heap()
         
-        return session_id, memory
+        return session_id, record, evicted + self._evict_over_budget()
+    
+    def _pop_oldest(self) -> Tuple[str, SessionRecord]:
+        session_id, record = self.sessions.popitem(last=False)
+        self.total_bytes -= record.size
+        return session_id, record
+    
+    def _evict_over_budget(self) -> List[Tuple[str, SessionRecord]]:
+        """Remove least recently used sessions until RAM is within max_bytes (keeping the newest)"""
+        evicted = []
+        while self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self.sessions) > 1:
+            evicted.append(self._pop_oldest())
+        return evicted
+    
+    def _resized(self, session_id: str, record: SessionRecord, delta: int):
+        # A memory can outlive its session's time in RAM; only count records still held
+        if self.sessions.get(session_id) is record:
+            self.total_bytes += delta
+    
+    def _spill(self, evicted: List[Tuple[str, SessionRecord]]):
+        """Write sessions leaving RAM to the spill tier (a shared store already has them)"""
+        if self.store is None or self.shared_store or not evicted:
+            return
+        # Sessions with no turns have nothing worth keeping
+        evicted = [(session_id, record) for session_id, record in evicted if record.turns]
+        try:
+            self.store.save_many(
+                (session_id, (record.created_at, record.last_accessed, record.turns))
+                for session_id, record in evicted
+            )
+            self.spilled += len(evicted)
+        except Exception as e:
+            print(f"Error spilling sessions to store: {e}")
+    
+    async def _aspill(self, evicted: List[Tuple[str, SessionRecord]]):
+        """_spill in a worker thread; the sessions stay reachable until they are written"""
+        if self.store is None or self.shared_store or not evicted:
+            return
+        for session_id, record in evicted:
+            self._spilling[session_id] = record
+        try:
+            await asyncio.to_thread(self._spill, evicted)
+        finally:
+            for session_id, record in evicted:
+                if self._spilling.get(session_id) is record:
+                    del self._spilling[session_id]
+    
+    def _load_stored(self, session_id: str) -> Optional[StoredSession]:
+        """Read a session's history from the store (blocking)"""
+        try:
+            # A spill tier hands the session back to RAM; a shared store keeps it for other workers
+            return self.store.load(session_id) if self.shared_store else self.store.pop(session_id)
+        except Exception as e:
+            print(f"Error reloading session from store: {e}")
+            return None
+    
+    def _apply_stored(self, record: SessionRecord, stored: StoredSession):
+        record.created_at, _, record.turns = stored
+        self.reloaded += 1
+    
+    def _write_through(self, session_id: str, record: SessionRecord):
+        """Persist a changed session to the shared store (blocking; the agent calls it from a worker thread)"""
+        try:
+            self.store.save(session_id, (record.created_at, record.last_accessed, list(record.turns)))
+        except Exception as e:
+            print(f"Error writing session to store: {e}")
+    
+    def import_messages(self, session_id: str, messages: list[Dict]) -> ConversationBufferWindowMemory:
+        """Seed a session's memory with existing messages (dicts with role and content) in one pass"""
+        _, memory = self.get_or_create_session(session_id)
+        memory.chat_memory.add_messages([
+            HumanMessage(content=msg["content"]) if msg["role"] == "user" else AIMessage(content=msg["content"])
+            for msg in messages
+        ])
+        return memory
+    
+    async def aimport_messages(self, session_id: str, messages: list[Dict]) -> ConversationBufferWindowMemory:
+        """import_messages without blocking the event loop on the store"""
+        _, memory = await self.aget_or_create_session(session_id)
+        await memory.chat_memory.aadd_messages([
+            HumanMessage(content=msg["content"]) if msg["role"] == "user" else AIMessage(content=msg["content"])
+            for msg in messages
+        ])
+        return memory
     
     def get_session_memory(self, session_id: str) -> Optional[ConversationBufferWindowMemory]:
         """Get memory for a specific session"""
-        if session_id in self.sessions:
-            self.sessions[session_id]["last_accessed"] = time.time()
-            return self.sessions[session_id]["memory"]
+        record = self.sessions.get(session_id)
+        if record is not None:
+            record.last_accessed = time.time()
+            return self._build_memory(session_id, record)
         return None
     
     def clear_session(self, session_id: str) -> bool:
         """Clear a specific session"""
+        if self.store is not None:
+            self.store.delete(session_id)
         if session_id in self.sessions:
-            del self.sessions[session_id]
+            self.total_bytes -= self.sessions.pop(session_id).size
             return True
         return False
     
@@ -64,20 +306,138 @@ class SessionManager:
         """Get current number of active sessions"""
         return len(self.sessions)
     
+    def get_stats(self) -> Dict:
+        """Session counts and approximate bytes for RAM, and counts for the disk tier"""
+        return {
+            "active_sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "spilled": self.spilled,
+            "reloaded": self.reloaded
+        }
+    
     def cleanup_old_sessions(self, max_age_hours: int = 24) -> int:
         """Remove sessions older than max_age_hours"""
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
+        return self.expire_idle_sessions(max_age_hours * 3600)
+    
+    def expire_idle_sessions(self, max_idle_seconds: float, max_expired: Optional[int] = None) -> int:
+        """Remove sessions idle for longer than max_idle_seconds in O(k log n) for k expired"""
+        expired_records = self._pop_idle_sessions(max_idle_seconds, max_expired)
+        self._spill(expired_records)
+        return len(expired_records)
+    
+    async def aexpire_idle_sessions(self, max_idle_seconds: float, max_expired: Optional[int] = None) -> int:
+        """expire_idle_sessions with the spill write in a worker thread"""
+        expired_records = self._pop_idle_sessions(max_idle_seconds, max_expired)
+        await self._aspill(expired_records)
+        return len(expired_records)
+    
+    def _pop_idle_sessions(self, max_idle_seconds: float, max_expired: Optional[int]) -> List[Tuple[str, SessionRecord]]:
+        cutoff = time.time() - max_idle_seconds
+        heap = self._expiry_heap
+        expired = 0
+        expired_records = []
         
-        sessions_to_remove = []
-        for session_id, session_data in self.sessions.items():
-            if current_time - session_data["last_accessed"] > max_age_seconds:
-                sessions_to_remove.append(session_id)
+        while heap and heap[0][0] <= cutoff and (max_expired is None or expired < max_expired):
+            heap_ts, session_id = heapq.heappop(heap)
+            record = self.sessions.get(session_id)
+            if record is None or record.heap_ts != heap_ts:
+                # Session was evicted, cleared or replaced since this entry was pushed
+                continue
+            
+            if record.last_accessed > cutoff:
+                # Touched since the snapshot; re-queue with its current access time
+                record.heap_ts = record.last_accessed
+                heapq.heappush(heap, (record.heap_ts, session_id))
+                continue
+            
+            expired_records.append((session_id, self.sessions.pop(session_id)))
+            self.total_bytes -= record.size
+            expired += 1
         
-        for session_id in sessions_to_remove:
-            del self.sessions[session_id]
+        return expired_records
+    
+    def _compact_expiry_heap(self):
+        """Rebuild the heap when stale entries from evictions outnumber live sessions"""
+        if len(self._expiry_heap) > 2 * len(self.sessions) + 1024:
+            self._expiry_heap = [(record.heap_ts, session_id) for session_id, record in self.sessions.items()]
+            heapq.heapify(self._expiry_heap)
+
+class SessionExpiryService:
+    """Background task that periodically expires idle sessions from a SessionManager"""
+    
+    def __init__(self, manager: SessionManager, max_idle_seconds: float, interval_seconds: float = 60, batch_size: int = 5000):
+        self.manager = manager
+        self.max_idle_seconds = max_idle_seconds
+        self.interval_seconds = interval_seconds
+        # Upper bound on sessions removed per sweep, so a large backlog never stalls the event loop
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.total_expired = 0
+        self.last_expired = 0
+        self.last_sweep_ms = 0.0
+        self.max_sweep_ms = 0.0
+    
+    def start(self):
+        """Start the sweep loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Cancel the sweep loop and wait for it to finish"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def sweep(self) -> int:
+        """Expire idle sessions once and record how many were removed and how long it took"""
+        started = time.perf_counter()
+        expired = self.manager.expire_idle_sessions(self.max_idle_seconds, self.batch_size)
+        self._record_sweep(expired, started)
+        return expired
+    
+    async def asweep(self) -> int:
+        """sweep without blocking the event loop on spill writes"""
+        started = time.perf_counter()
+        expired = await self.manager.aexpire_idle_sessions(self.max_idle_seconds, self.batch_size)
+        self._record_sweep(expired, started)
+        return expired
+    
+    def _record_sweep(self, expired: int, started: float):
+        elapsed_ms = (time.perf_counter() - started) * 1000
         
-        return len(sessions_to_remove)
+        self.sweeps += 1
+        self.total_expired += expired
+        self.last_expired = expired
+        self.last_sweep_ms = elapsed_ms
+        self.max_sweep_ms = max(self.max_sweep_ms, elapsed_ms)
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                # Keep sweeping in batches while there is a backlog, yielding in between
+                while await self.asweep() >= self.batch_size:
+                    await asyncio.sleep(0)
+            except Exception as e:
+                print(f"Error expiring sessions: {e}")
+    
+    def stats(self) -> Dict:
+        """Sweep counters and timings"""
+        return {
+            "active_sessions": self.manager.get_session_count(),
+            "sweeps": self.sweeps,
+            "total_expired": self.total_expired,
+            "last_expired": self.last_expired,
+            "last_sweep_ms": round(self.last_sweep_ms, 3),
+            "max_sweep_ms": round(self.max_sweep_ms, 3)
+        }
 
 # Global session manager instance
-session_manager = SessionManager(max_sessions=25, memory_window=10)
\ No newline at end of file
+session_manager = SessionManager(max_sessions=100_000, memory_window=10)
\ No newline at end of file
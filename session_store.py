@@ -0,0 +1,219 @@
+"""
+Pluggable storage behind the in-memory SessionManager: a local SQLite file (spill tier or
+shared across workers on one host) or a Redis-protocol server (shared across hosts).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# (created_at, last_accessed, turns) where turns is a list of (role, content)
+StoredSession = Tuple[float, float, List[Tuple[str, str]]]
+
+
+class SessionStore(ABC):
+    """Interface for session storage backends"""
+    
+    def save(self, session_id: str, session: StoredSession):
+        """Write one session"""
+        self.save_many([(session_id, session)])
+    
+    @abstractmethod
+    def save_many(self, sessions: Iterable[Tuple[str, StoredSession]]):
+        """Write several sessions"""
+    
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        """Read a session without removing it"""
+    
+    @abstractmethod
+    def pop(self, session_id: str) -> Optional[StoredSession]:
+        """Remove and return a session"""
+    
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a session"""
+    
+    def close(self):
+        """Release connections"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite store bounded by row count and age; WAL mode lets several worker processes share one file"""
+    
+    def __init__(self, path: str, max_sessions: int = 1_000_000, max_age_seconds: float = 7 * 24 * 3600, prune_every: int = 1000):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_age_seconds = max_age_seconds
+        self.prune_every = prune_every
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Wait for other worker processes' write transactions instead of failing
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                turns TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_stored_at ON sessions(stored_at)")
+    
+    def save_many(self, sessions: Iterable[Tuple[str, StoredSession]]):
+        """Write several sessions in one transaction"""
+        now = time.time()
+        rows = [
+            (session_id, created_at, last_accessed, json.dumps(turns, ensure_ascii=False), now)
+            for session_id, (created_at, last_accessed, turns) in sessions
+        ]
+        if not rows:
+            return
+        
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sessions (session_id, created_at, last_accessed, turns, stored_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.execute("COMMIT")
+            
+            self._writes_since_prune += len(rows)
+            if self._writes_since_prune >= self.prune_every:
+                self._prune()
+    
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        """Read a session, or None if it is missing or too old"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, last_accessed, turns, stored_at FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        
+        return self._decode(row)
+    
+    def pop(self, session_id: str) -> Optional[StoredSession]:
+        """Remove and return a session, or None if it is missing or too old"""
+        with self._lock:
+            rows = self._conn.execute(
+                "DELETE FROM sessions WHERE session_id = ? RETURNING created_at, last_accessed, turns, stored_at",
+                (session_id,)
+            ).fetchall()
+        
+        return self._decode(rows[0] if rows else None)
+    
+    def _decode(self, row) -> Optional[StoredSession]:
+        if row is None or time.time() - row[3] > self.max_age_seconds:
+            return None
+        
+        created_at, last_accessed, turns, _ = row
+        return created_at, last_accessed, [tuple(turn) for turn in json.loads(turns)]
+    
+    def delete(self, session_id: str):
+        """Remove a session"""
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+    
+    def count(self) -> int:
+        """Number of stored sessions"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    
+    def prune(self) -> int:
+        """Drop sessions past max_age_seconds and the oldest ones beyond max_sessions"""
+        with self._lock:
+            return self._prune()
+    
+    def _prune(self) -> int:
+        self._writes_since_prune = 0
+        cursor = self._conn.execute("DELETE FROM sessions WHERE stored_at < ?", (time.time() - self.max_age_seconds,))
+        removed = cursor.rowcount
+        cursor = self._conn.execute(
+            "DELETE FROM sessions WHERE session_id IN (SELECT session_id FROM sessions ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+        return removed + cursor.rowcount
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Store on a Redis-protocol server, one JSON value per session that expires after max_age_seconds"""
+    
+    def __init__(self, url: str = "redis://localhost:6379/0", max_age_seconds: float = 7 * 24 * 3600, key_prefix: str = "kheti:session:", client=None):
+        if client is None:
+            if redis is None:
+                raise ImportError("The redis package is required for RedisSessionStore (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.max_age_seconds = max_age_seconds
+        self.key_prefix = key_prefix
+    
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+    
+    def save_many(self, sessions: Iterable[Tuple[str, StoredSession]]):
+        """Write several sessions in one pipelined round trip"""
+        pipe = self.client.pipeline(transaction=False)
+        for session_id, (created_at, last_accessed, turns) in sessions:
+            value = json.dumps([created_at, last_accessed, turns], ensure_ascii=False)
+            pipe.set(self._key(session_id), value, ex=int(self.max_age_seconds))
+        pipe.execute()
+    
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        """Read a session without removing it"""
+        return self._decode(self.client.get(self._key(session_id)))
+    
+    def pop(self, session_id: str) -> Optional[StoredSession]:
+        """Remove and return a session"""
+        pipe = self.client.pipeline(transaction=True)
+        pipe.get(self._key(session_id))
+        pipe.delete(self._key(session_id))
+        value, _ = pipe.execute()
+        return self._decode(value)
+    
+    def delete(self, session_id: str):
+        """Remove a session"""
+        self.client.delete(self._key(session_id))
+    
+    def close(self):
+        self.client.close()
+    
+    def _decode(self, value) -> Optional[StoredSession]:
+        if value is None:
+            return None
+        created_at, last_accessed, turns = json.loads(value)
+        return created_at, last_accessed, [tuple(turn) for turn in turns]
+
+
+def create_session_store(backend: str, path: str, redis_url: str, max_sessions: int, max_age_seconds: float) -> Optional[SessionStore]:
+    """Build the store for a backend name: memory (no store), spill or sqlite (SQLite file), or redis"""
+    if backend == "memory":
+        return None
+    if backend in ("spill", "sqlite"):
+        return SQLiteSessionStore(path, max_sessions=max_sessions, max_age_seconds=max_age_seconds)
+    if backend == "redis":
+        return RedisSessionStore(redis_url, max_age_seconds=max_age_seconds)
+    raise ValueError(f"Unknown session store backend: {backend}")
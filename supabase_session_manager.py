@@ -1,33 +1,106 @@
 import uuid
 from typing import Dict, List, Optional, Tuple
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.schema import HumanMessage, AIMessage
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from ttl_cache import TTLCache
+from message_journal import MessageJournal, WriteBehindPersister
 
 load_dotenv()
 
+# Maximum number of concurrent blocking PostgREST calls
+SUPABASE_DB_WORKERS = int(os.getenv("SUPABASE_DB_WORKERS", "16"))
+
+# Bounds for the cache of per-session conversation memories
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "2000"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "3600"))
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Rough fixed cost of a cached memory object on top of its message text
+MEMORY_OVERHEAD_BYTES = 2048
+
+def estimate_memory_size(memory: ConversationBufferWindowMemory) -> int:
+    """Approximate bytes held by a conversation memory"""
+    return MEMORY_OVERHEAD_BYTES + sum(
+        len(msg.content) * 2 if isinstance(msg.content, str) else 512
+        for msg in memory.chat_memory.messages
+    )
+
+def is_permanent_write_error(error: Exception) -> bool:
+    """
+    True when PostgREST rejected the rows themselves, so retrying can never succeed: a
+    constraint or data error (e.g. a message whose session was deleted) or another 4xx.
+    Connection errors, 5xx responses, auth failures and rate limits are transient.
+    """
+    if not isinstance(error, APIError):
+        return False
+    code = str(error.code or "")
+    # SQLSTATE class 22 (data exception) and 23 (integrity constraint violation)
+    if code[:2] in ("22", "23") and len(code) == 5:
+        return True
+    # PGRST1xx: PostgREST could not accept the request as sent
+    if code.startswith("PGRST1"):
+        return True
+    # Non-JSON error bodies carry the HTTP status as the code
+    return code.isdigit() and 400 <= int(code) < 500 and int(code) not in (401, 403, 408, 429)
+
+
 class SupabaseSessionManager:
     """Manages chat sessions with Supabase storage"""
     
-    def __init__(self, memory_window: int = 10):
+    def __init__(
+        self,
+        memory_window: int = 10,
+        db_workers: int = SUPABASE_DB_WORKERS,
+        cache_max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        cache_ttl_seconds: float = SESSION_CACHE_TTL_SECONDS,
+        cache_max_bytes: int = SESSION_CACHE_MAX_BYTES
+    ):
         self.memory_window = memory_window
         self.supabase: Client = create_client(
             os.getenv("SUPABASE_URL"),
             os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # Use service role for backend operations
         )
-        # In-memory cache for active sessions
-        self._memory_cache: Dict[str, ConversationBufferWindowMemory] = {}
+        # Dedicated, bounded pool for the sync client's blocking execute() calls
+        self._db_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="supabase-db")
+        # Bounded LRU/idle-TTL cache of memories for active sessions
+        self._memory_cache = TTLCache(
+            max_entries=cache_max_entries,
+            ttl_seconds=cache_ttl_seconds,
+            max_bytes=cache_max_bytes,
+            sizeof=estimate_memory_size
+        )
+        # Optional write-behind persistence (see enable_write_behind)
+        self.persister: Optional[WriteBehindPersister] = None
+    
+    def enable_write_behind(self, journal_path: str, **kwargs) -> WriteBehindPersister:
+        """Journal new messages locally and flush them to Supabase in the background"""
+        self.persister = WriteBehindPersister(
+            MessageJournal(journal_path),
+            self._insert_message_rows,
+            is_permanent_error=is_permanent_write_error,
+            **kwargs
+        )
+        return self.persister
+    
+    async def _execute(self, query):
+        """Run a query's blocking execute() in the DB pool so the event loop is never stalled"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, query.execute)
     
     async def create_session(self, user_id: str, title: str = "New Chat", is_public: bool = False) -> str:
         """Create a new chat session in Supabase"""
         try:
-            result = self.supabase.table("chat_sessions").insert({
+            result = await self._execute(self.supabase.table("chat_sessions").insert({
                 "user_id": user_id,
                 "title": title,
                 "is_public": is_public
-            }).execute()
+            }))
             
             session_id = result.data[0]["id"]
             return session_id
@@ -40,7 +113,7 @@ class SupabaseSessionManager:
         try:
             query = self.supabase.table("chat_sessions").select("*").eq("id", session_id)
             
-            result = query.execute()
+            result = await self._execute(query)
             
             if not result.data:
                 return None
@@ -64,11 +137,12 @@ class SupabaseSessionManager:
     async def get_user_sessions(self, user_id: str) -> List[Dict]:
         """Get all sessions for a user"""
         try:
-            result = self.supabase.table("chat_sessions")\
+            query = self.supabase.table("chat_sessions")\
                 .select("id, title, is_public, created_at, updated_at")\
                 .eq("user_id", user_id)\
-                .order("updated_at", desc=True)\
-                .execute()
+                .order("updated_at", desc=True)
+            
+            result = await self._execute(query)
             
             return result.data
         except Exception as e:
@@ -78,11 +152,12 @@ class SupabaseSessionManager:
     async def update_session(self, session_id: str, user_id: str, **kwargs) -> bool:
         """Update session details (title, is_public, etc.)"""
         try:
-            result = self.supabase.table("chat_sessions")\
+            query = self.supabase.table("chat_sessions")\
                 .update(kwargs)\
                 .eq("id", session_id)\
-                .eq("user_id", user_id)\
-                .execute()
+                .eq("user_id", user_id)
+            
+            result = await self._execute(query)
             
             return len(result.data) > 0
         except Exception as e:
@@ -92,15 +167,17 @@ class SupabaseSessionManager:
     async def delete_session(self, session_id: str, user_id: str) -> bool:
         """Delete a session and all its messages"""
         try:
-            result = self.supabase.table("chat_sessions")\
+            query = self.supabase.table("chat_sessions")\
                 .delete()\
                 .eq("id", session_id)\
-                .eq("user_id", user_id)\
-                .execute()
+                .eq("user_id", user_id)
+            
+            result = await self._execute(query)
             
             # Clear from cache
-            if session_id in self._memory_cache:
-                del self._memory_cache[session_id]
+            self._memory_cache.pop(session_id)
+            if self.persister is not None:
+                self.persister.discard_session(session_id)
             
             return len(result.data) > 0
         except Exception as e:
@@ -108,50 +185,121 @@ class SupabaseSessionManager:
             return False
     
     async def add_message(self, session_id: str, role: str, content: str) -> bool:
-        """Add a message to a session"""
+        """Add a message to a session (the session's updated_at is touched by a DB trigger)"""
+        return await self.add_messages(session_id, [{"role": role, "content": content}])
+    
+    async def add_messages(self, session_id: str, messages: List[Dict]) -> bool:
+        """Add several messages (dicts with role and content) to a session in a single insert"""
+        if not messages:
+            return True
+        
+        if self.persister is not None:
+            try:
+                # Durable once journaled; the background task writes it to Supabase
+                await self.persister.enqueue(session_id, messages)
+                return True
+            except Exception as e:
+                print(f"Could not journal messages, writing directly: {e}")
+        
         try:
-            self.supabase.table("chat_messages").insert({
-                "session_id": session_id,
-                "role": role,
-                "content": content
-            }).execute()
-            
-            # Update session's updated_at
-            self.supabase.table("chat_sessions")\
-                .update({"updated_at": "now()"})\
-                .eq("id", session_id)\
-                .execute()
+            await self._execute(self.supabase.table("chat_messages").insert([
+                {
+                    "session_id": session_id,
+                    "role": msg["role"],
+                    "content": msg["content"]
+                }
+                for msg in messages
+            ]))
             
             return True
         except Exception as e:
-            print(f"Error adding message: {e}")
+            print(f"Error adding messages: {e}")
             return False
     
+    async def _insert_message_rows(self, rows: List[Dict]):
+        """Write journaled rows; ids make retries idempotent"""
+        await self._execute(
+            self.supabase.table("chat_messages").upsert(rows, on_conflict="id", ignore_duplicates=True)
+        )
+    
+    async def fork_session(self, source_session_id: str, user_id: str, title: str) -> str:
+        """Copy a session and all its messages into a new private session for user_id"""
+        # The SQL function only sees flushed rows; copy client-side if some are still journaled
+        has_pending = self.persister is not None and await asyncio.to_thread(self.persister.has_pending, source_session_id)
+        
+        if not has_pending:
+            try:
+                # One round trip: the fork_chat_session SQL function copies rows server-side
+                result = await self._execute(self.supabase.rpc("fork_chat_session", {
+                    "p_source_session_id": source_session_id,
+                    "p_user_id": user_id,
+                    "p_title": title
+                }))
+                return result.data
+            except Exception as e:
+                print(f"fork_chat_session unavailable, falling back to batched copy: {e}")
+        
+        # Fallback: one read and one batched insert
+        messages = await self.get_messages(source_session_id)
+        new_session_id = await self.create_session(user_id=user_id, title=title, is_public=False)
+        if not await self.add_messages(new_session_id, messages):
+            raise RuntimeError("Could not copy messages to forked session")
+        return new_session_id
+    
     async def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
-        """Get messages for a session"""
+        """Get messages for a session (only the last `limit` messages if given), oldest first"""
         try:
-            query = self.supabase.table("chat_messages")\
-                .select("role, content, created_at")\
-                .eq("session_id", session_id)\
-                .order("created_at", desc=False)
-            
             if limit:
-                # Get last N messages
-                all_messages = query.execute().data
-                return all_messages[-limit:] if len(all_messages) > limit else all_messages
-            
-            result = query.execute()
-            return result.data
+                # Let the database pick the last N messages, then restore chronological order
+                query = self.supabase.table("chat_messages")\
+                    .select("id, role, content, created_at")\
+                    .eq("session_id", session_id)\
+                    .order("created_at", desc=True)\
+                    .limit(limit)
+                
+                result = await self._execute(query)
+                messages = list(reversed(result.data))
+            else:
+                query = self.supabase.table("chat_messages")\
+                    .select("id, role, content, created_at")\
+                    .eq("session_id", session_id)\
+                    .order("created_at", desc=False)
+                
+                result = await self._execute(query)
+                messages = result.data
         except Exception as e:
             print(f"Error getting messages: {e}")
-            return []
+            # Messages still in the journal were acknowledged; an outage must not hide them
+            messages = []
+        
+        if self.persister is not None:
+            try:
+                messages = await self._merge_pending(session_id, messages, limit)
+            except Exception as e:
+                print(f"Error reading journaled messages: {e}")
+        
+        return messages
+    
+    async def _merge_pending(self, session_id: str, messages: List[Dict], limit: Optional[int]) -> List[Dict]:
+        """Append journaled messages that have not reached the database yet"""
+        pending = await asyncio.to_thread(self.persister.pending_for, session_id)
+        if not pending:
+            return messages
+        
+        # A row can be both flushed and still journaled for a moment; ids tell them apart
+        flushed_ids = {msg.get("id") for msg in messages}
+        messages = messages + [msg for msg in pending if msg["id"] not in flushed_ids]
+        return messages[-limit:] if limit else messages
     
     async def get_or_create_memory(self, session_id: str) -> ConversationBufferWindowMemory:
         """Get memory for a session, loading from DB if needed"""
         
         # Check cache first
-        if session_id in self._memory_cache:
-            return self._memory_cache[session_id]
+        memory = self._memory_cache.get(session_id)
+        if memory is not None:
+            # The window only reads the last k turns; drop older ones so cached entries stay small
+            del memory.chat_memory.messages[:-self.memory_window * 2]
+            return memory
         
         # Create new memory
         memory = ConversationBufferWindowMemory(
@@ -171,56 +319,36 @@ class SupabaseSessionManager:
                 memory.chat_memory.add_message(AIMessage(content=msg["content"]))
         
         # Cache the memory
-        self._memory_cache[session_id] = memory
+        self._memory_cache.set(session_id, memory)
         
         return memory
     
     def clear_memory_cache(self, session_id: str):
         """Clear memory cache for a session"""
-        if session_id in self._memory_cache:
-            del self._memory_cache[session_id]
+        self._memory_cache.pop(session_id)
+    
+    def get_cache_stats(self) -> Dict:
+        """Hit, miss and eviction counters of the memory cache"""
+        return self._memory_cache.stats()
     
-    async def generate_session_title(self, session_id: str) -> str:
-        """Generate a concise, descriptive title from the first user message using LangChain"""
-        messages = None
+    async def set_generated_title(self, session_id: str, user_id: str, title: str, expected: str = "New Chat") -> bool:
+        """
+        Set a generated title only if the session still has the expected (default) title, so a
+        rename by the user or a title written by another worker is never overwritten
+        """
         try:
-            print(f"[TITLE] Fetching messages for session {session_id}...")
-            # Get ALL messages and find the first user message
-            all_messages = await self.get_messages(session_id, limit=None)
-            print(f"[TITLE] Got {len(all_messages) if all_messages else 0} total messages")
-            
-            # Find the first user message
-            user_message = None
-            for msg in all_messages:
-                if msg["role"] == "user":
-                    user_message = msg
-                    break
-            
-            if user_message:
-                from title_generator import generate_chat_title
-                content = user_message["content"]
-                
-                print(f"[TITLE] Calling title generator with content: {content[:100]}...")
-                # Use LangChain to generate a smart title
-                title = generate_chat_title(content)
-                print(f"[TITLE] Title generator returned: {title}")
-                return title
-            else:
-                print("[TITLE] No user messages found in session")
+            query = self.supabase.table("chat_sessions")\
+                .update({"title": title})\
+                .eq("id", session_id)\
+                .eq("user_id", user_id)\
+                .eq("title", expected)
+            
+            result = await self._execute(query)
+            
+            return len(result.data) > 0
         except Exception as e:
-            print(f"[TITLE] Error generating title: {e}")
-            import traceback
-            traceback.print_exc()
-            # Fallback to simple truncation if we have a user message
-            if user_message:
-                content = user_message["content"]
-                title = content[:50].split('.')[0].strip()
-                if len(content) > 50:
-                    title += "..."
-                return title
-        
-        print("[TITLE] Returning default 'New Chat'")
-        return "New Chat"
+            print(f"Error setting session title: {e}")
+            return False
 
 # Global session manager instance
 supabase_session_manager = SupabaseSessionManager(memory_window=10)
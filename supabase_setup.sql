@@ -25,7 +25,8 @@ CREATE TABLE IF NOT EXISTS chat_messages (
     session_id UUID REFERENCES chat_sessions(id) ON DELETE CASCADE,
     role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
     content TEXT NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    -- clock_timestamp() so rows inserted in one statement keep their order
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT clock_timestamp()
 );
 
 -- Create indexes for performance
@@ -33,6 +34,8 @@ CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_chat_sessions_is_public ON chat_sessions(is_public);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages(session_id);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at ON chat_messages(created_at);
+-- Serves "last N messages of a session" (ORDER BY created_at DESC LIMIT N) from the index
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created_at ON chat_messages(session_id, created_at);
 
 -- Enable Row Level Security
 ALTER TABLE chat_sessions ENABLE ROW LEVEL SECURITY;
@@ -112,3 +115,47 @@ CREATE TRIGGER update_chat_sessions_updated_at
     BEFORE UPDATE ON chat_sessions
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
+
+-- Keep message order for batched inserts on databases created before the default changed
+ALTER TABLE chat_messages ALTER COLUMN created_at SET DEFAULT clock_timestamp();
+
+-- Function to touch the parent session whenever messages are added,
+-- so persisting a message is a single round trip
+CREATE OR REPLACE FUNCTION touch_chat_session_on_message()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE chat_sessions
+    SET updated_at = NOW()
+    WHERE id IN (SELECT DISTINCT session_id FROM new_messages);
+    RETURN NULL;
+END;
+$$ language 'plpgsql' SECURITY DEFINER SET search_path = public;
+
+-- Trigger to touch chat_sessions.updated_at once per insert statement
+DROP TRIGGER IF EXISTS touch_chat_session_on_message ON chat_messages;
+CREATE TRIGGER touch_chat_session_on_message
+    AFTER INSERT ON chat_messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION touch_chat_session_on_message();
+
+-- Function to fork a session: creates a private copy for p_user_id and
+-- copies all messages server-side, returning the new session id
+CREATE OR REPLACE FUNCTION fork_chat_session(p_source_session_id UUID, p_user_id UUID, p_title TEXT)
+RETURNS UUID AS $$
+DECLARE
+    new_session_id UUID;
+BEGIN
+    INSERT INTO chat_sessions (user_id, title, is_public)
+    VALUES (p_user_id, p_title, FALSE)
+    RETURNING id INTO new_session_id;
+
+    INSERT INTO chat_messages (session_id, role, content, created_at)
+    SELECT new_session_id, role, content, created_at
+    FROM chat_messages
+    WHERE session_id = p_source_session_id
+    ORDER BY created_at;
+
+    RETURN new_session_id;
+END;
+$$ language 'plpgsql';
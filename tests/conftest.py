@@ -0,0 +1,20 @@
+"""
+Shared test setup: the server modules read their configuration at import time, so
+placeholder credentials are set before any test imports them. No test talks to Supabase,
+Gemini or Redis.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test-anon-key")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test-service-role-key")
+os.environ.setdefault("GOOGLE_API_KEY", "test-google-api-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "test-jwt-secret-with-at-least-32-bytes")
+# Keep the write-behind journal and the session store out of the working tree
+os.environ.setdefault("MESSAGE_WRITE_BEHIND", "false")
+os.environ.setdefault("SESSION_STORE", "memory")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,46 @@
+"""
+Stand-ins for the chat model used by the server tests.
+"""
+
+import asyncio
+import time
+
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from prompt import prompt
+from tools import tools
+
+
+class SlowChatModel(BaseChatModel):
+    """Answers "ok" after `delay` seconds; the async path sleeps without blocking the loop"""
+    
+    delay: float = 1.0
+    reply: str = "ok"
+    
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+    
+    def bind_tools(self, tools, **kwargs):
+        return self
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+
+def agent_factory(model: BaseChatModel):
+    """Drop-in for main.create_agent_with_memory that runs the real agent on a fake model"""
+    agent = create_tool_calling_agent(llm=model, prompt=prompt, tools=tools)
+    
+    def create_agent_with_memory(memory):
+        return AgentExecutor(agent=agent, tools=tools, memory=memory)
+    
+    return create_agent_with_memory
@@ -0,0 +1,43 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import auth_service
+from auth_service import AuthService
+
+LOOKUP_DELAY = 0.2
+USERS = 10
+
+
+def fake_get_user(jwt):
+    """Stands in for GoTrue: answers for the token it was given, after a network-like delay"""
+    time.sleep(LOOKUP_DELAY)
+    user_id = jwt.removeprefix("token-")
+    return SimpleNamespace(user=SimpleNamespace(
+        id=user_id,
+        email=f"{user_id}@example.com",
+        email_confirmed_at=None,
+        user_metadata={},
+        created_at=None
+    ))
+
+
+async def look_up_all(tokens):
+    return await asyncio.gather(*[AuthService.get_current_user(token) for token in tokens])
+
+
+def test_interleaved_lookups_each_get_their_own_identity(monkeypatch):
+    monkeypatch.setattr(auth_service, "auth_remote_verify", True)
+    monkeypatch.setattr(auth_service.supabase.auth, "get_user", fake_get_user)
+    
+    # Each user twice, interleaved, so lookups for different users overlap
+    tokens = [f"token-user-{i % USERS}" for i in range(2 * USERS)]
+    
+    started = time.perf_counter()
+    users = asyncio.run(look_up_all(tokens))
+    elapsed = time.perf_counter() - started
+    
+    assert [user["id"] for user in users] == [token.removeprefix("token-") for token in tokens]
+    assert [user["email"] for user in users] == [f"{user['id']}@example.com" for user in users]
+    # Serialized lookups would take 2 * USERS * LOOKUP_DELAY = 4 s
+    assert elapsed < 2 * USERS * LOOKUP_DELAY / 2, f"lookups took {elapsed:.2f}s"
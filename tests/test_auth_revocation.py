@@ -0,0 +1,64 @@
+import asyncio
+import time
+import uuid
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+import auth_service
+from auth_service import AuthService
+
+
+def make_token(session_id=None, user_id="user-1", lifetime=3600):
+    claims = {"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + lifetime}
+    if session_id:
+        claims["session_id"] = session_id
+    return jwt.encode(claims, auth_service.jwt_secret, algorithm="HS256")
+
+
+@pytest.fixture(autouse=True)
+def local_verification(monkeypatch):
+    monkeypatch.setattr(auth_service, "auth_remote_verify", False)
+    monkeypatch.setattr(auth_service.supabase.auth.admin, "sign_out", lambda *args, **kwargs: None)
+
+
+def test_signed_out_token_is_refused_even_though_it_was_cached():
+    token = make_token(session_id=str(uuid.uuid4()))
+    assert asyncio.run(AuthService.get_current_user(token))["id"] == "user-1"
+    
+    asyncio.run(AuthService.sign_out(token))
+    
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(AuthService.get_current_user(token))
+    assert error.value.status_code == 401
+
+
+def test_sign_out_covers_every_token_of_the_login():
+    session_id = str(uuid.uuid4())
+    first, refreshed = make_token(session_id), make_token(session_id, lifetime=3500)
+    asyncio.run(AuthService.get_current_user(refreshed))
+    
+    asyncio.run(AuthService.sign_out(first))
+    
+    with pytest.raises(HTTPException):
+        asyncio.run(AuthService.get_current_user(refreshed))
+
+
+def test_other_logins_of_the_same_user_stay_valid():
+    mine, other = make_token(str(uuid.uuid4())), make_token(str(uuid.uuid4()))
+    
+    asyncio.run(AuthService.sign_out(mine))
+    
+    assert asyncio.run(AuthService.get_current_user(other))["id"] == "user-1"
+
+
+def test_revocations_expire_with_the_token():
+    revoked = auth_service.RevokedTokens(max_size=2)
+    revoked.revoke("session:old", time.time() - 1)
+    revoked.revoke("session:a", time.time() + 60)
+    revoked.revoke("session:b", time.time() + 60)
+    
+    assert not revoked.is_revoked("session:old")
+    assert revoked.is_revoked("session:a") and revoked.is_revoked("session:b")
+    assert len(revoked) == 2
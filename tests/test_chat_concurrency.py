@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+import httpx
+
+import server
+from fakes import SlowChatModel, agent_factory
+
+PARALLEL_CHATS = 8
+
+
+async def post_chats(texts):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        return await asyncio.gather(*[client.post("/chat", json={"text": text}) for text in texts])
+
+
+def test_parallel_chats_finish_in_about_the_time_of_one(monkeypatch):
+    monkeypatch.setattr(server, "create_agent_with_memory", agent_factory(SlowChatModel(delay=1.0)))
+    
+    started = time.perf_counter()
+    responses = asyncio.run(post_chats([f"question {i}" for i in range(PARALLEL_CHATS)]))
+    elapsed = time.perf_counter() - started
+    
+    assert [response.status_code for response in responses] == [200] * PARALLEL_CHATS
+    assert all(response.json()["output"] == "ok" for response in responses)
+    # Run one after another they would take PARALLEL_CHATS seconds
+    assert elapsed < 2.0, f"{PARALLEL_CHATS} parallel chats took {elapsed:.2f}s"
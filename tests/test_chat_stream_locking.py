@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import httpx
+from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import server
+from fakes import SlowChatModel, agent_factory
+from session_locks import SessionLockTable
+
+
+class HistoryCountingModel(SlowChatModel):
+    """Replies with how many prompt messages it was given, so a turn shows what history it saw"""
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"saw {len(messages)}"))])
+
+
+def use_fake_database(monkeypatch):
+    """
+    Stand in for database sessions on a cold memory cache: every turn loads a fresh memory from
+    the stored messages, and the turn is stored when it finishes
+    """
+    stored = {}
+    
+    async def prepare_chat_turn(request, current_user):
+        memory = ConversationBufferWindowMemory(k=10, memory_key="chat_history", return_messages=True)
+        for text, output in stored.get(request.session_id, []):
+            memory.save_context({"text": text}, {"output": output})
+        return request.session_id, memory, False, None
+    
+    async def finish_chat_turn(session_id, text, output, current_user, use_database, title):
+        stored.setdefault(session_id, []).append((text, output))
+        return None
+    
+    monkeypatch.setattr(server, "prepare_chat_turn", prepare_chat_turn)
+    monkeypatch.setattr(server, "finish_chat_turn", finish_chat_turn)
+
+
+def parse_events(body: str):
+    events = []
+    for frame in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+async def stream_turns(session_id, texts, start_gap=0.05):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        async def turn(i, text):
+            await asyncio.sleep(i * start_gap)
+            return await client.post("/chat/stream", json={"text": text, "session_id": session_id})
+        return await asyncio.gather(*[turn(i, text) for i, text in enumerate(texts)])
+
+
+def test_queued_stream_turn_sees_the_turn_before_it(monkeypatch):
+    monkeypatch.setattr(server, "create_agent_with_memory", agent_factory(HistoryCountingModel(delay=0.3)))
+    use_fake_database(monkeypatch)
+    
+    first, second = asyncio.run(stream_turns("anon-locking", ["first question", "second question"]))
+    
+    outputs = [dict(parse_events(response.text))["done"]["output"] for response in (first, second)]
+    # System prompt + question, then the same plus the first turn's two messages
+    assert outputs == ["saw 2", "saw 4"]
+
+
+def test_busy_session_is_rejected_with_429(monkeypatch):
+    monkeypatch.setattr(server, "create_agent_with_memory", agent_factory(SlowChatModel(delay=0.3)))
+    monkeypatch.setattr(server, "session_locks", SessionLockTable(max_waiters_per_session=1))
+    use_fake_database(monkeypatch)
+    
+    first, second = asyncio.run(stream_turns("anon-busy", ["first question", "second question"]))
+    
+    assert first.status_code == 200
+    assert [event for event, _ in parse_events(first.text)][-1] == "done"
+    assert second.status_code == 429
+    # The lock was released once the first stream finished
+    assert len(server.session_locks) == 0
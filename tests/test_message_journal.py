@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from postgrest.exceptions import APIError
+
+from message_journal import MessageJournal, WriteBehindPersister
+from supabase_session_manager import SupabaseSessionManager, is_permanent_write_error
+
+
+def make_persister(tmp_path, flush):
+    journal = MessageJournal(str(tmp_path / "journal.db"))
+    return WriteBehindPersister(journal, flush, is_permanent_error=is_permanent_write_error)
+
+
+def enqueue(persister, session_id="s1"):
+    return asyncio.run(persister.enqueue(session_id, [
+        {"role": "user", "content": "hello"},
+        {"role": "assistant", "content": "namaste"}
+    ]))
+
+
+def test_outage_keeps_messages_however_long_it_lasts(tmp_path):
+    async def flush(rows):
+        raise ConnectionError("database unreachable")
+    
+    persister = make_persister(tmp_path, flush)
+    enqueue(persister)
+    
+    for _ in range(50):
+        with pytest.raises(ConnectionError):
+            asyncio.run(persister.flush_pending())
+    
+    stats = persister.stats()
+    assert stats["pending"] == 2
+    assert stats["dropped"] == 0
+    assert stats["failed_flushes"] == 50
+
+
+def test_server_errors_are_retried_not_dropped(tmp_path):
+    async def flush(rows):
+        raise APIError({"message": "Service Unavailable", "code": "503"})
+    
+    persister = make_persister(tmp_path, flush)
+    enqueue(persister)
+    
+    with pytest.raises(APIError):
+        asyncio.run(persister.flush_pending())
+    assert persister.stats()["pending"] == 2
+
+
+def test_only_rejected_rows_are_dropped(tmp_path):
+    written = []
+    
+    async def flush(rows):
+        if any(row["session_id"] == "deleted" for row in rows):
+            raise APIError({"message": "violates foreign key constraint", "code": "23503"})
+        written.extend(rows)
+    
+    persister = make_persister(tmp_path, flush)
+    enqueue(persister, "s1")
+    enqueue(persister, "deleted")
+    
+    asyncio.run(persister.flush_pending())
+    
+    assert [row["session_id"] for row in written] == ["s1", "s1"]
+    assert persister.stats() == {"pending": 0, "flushed": 2, "dropped": 2, "failed_flushes": 1}
+
+
+def test_outage_during_row_by_row_retry_keeps_the_rest(tmp_path):
+    calls = []
+    
+    async def flush(rows):
+        calls.append(rows)
+        if len(calls) == 1:
+            raise APIError({"message": "violates foreign key constraint", "code": "23503"})
+        raise ConnectionError("database unreachable")
+    
+    persister = make_persister(tmp_path, flush)
+    enqueue(persister)
+    
+    with pytest.raises(ConnectionError):
+        asyncio.run(persister.flush_pending())
+    assert persister.stats()["pending"] == 2
+    assert persister.stats()["dropped"] == 0
+
+
+@pytest.mark.parametrize("error, permanent", [
+    (APIError({"message": "fk", "code": "23503"}), True),
+    (APIError({"message": "bad uuid", "code": "22P02"}), True),
+    (APIError({"message": "bad request", "code": "PGRST102"}), True),
+    (APIError({"message": "no json", "code": 400}), True),
+    (APIError({"message": "unavailable", "code": "PGRST001"}), False),
+    (APIError({"message": "jwt expired", "code": "PGRST301"}), False),
+    (APIError({"message": "gateway", "code": 502}), False),
+    (APIError({"message": "rate limited", "code": 429}), False),
+    (ConnectionError("reset"), False),
+    (TimeoutError(), False),
+])
+def test_permanent_error_classification(error, permanent):
+    assert is_permanent_write_error(error) is permanent
+
+
+def test_history_keeps_journaled_messages_during_an_outage(tmp_path):
+    manager = SupabaseSessionManager()
+    manager.enable_write_behind(str(tmp_path / "journal.db"))
+    
+    async def execute(query):
+        raise ConnectionError("database unreachable")
+    
+    manager._execute = execute
+    
+    async def run():
+        await manager.add_messages("s1", [
+            {"role": "user", "content": "hello"},
+            {"role": "assistant", "content": "namaste"}
+        ])
+        return await manager.get_messages("s1"), await manager.get_messages("s1", limit=1)
+    
+    everything, last = asyncio.run(run())
+    assert [msg["content"] for msg in everything] == ["hello", "namaste"]
+    assert [msg["content"] for msg in last] == ["namaste"]
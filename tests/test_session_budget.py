@@ -0,0 +1,59 @@
+import asyncio
+
+from langchain.schema import AIMessage, HumanMessage
+
+from session_manager import RECORD_OVERHEAD_BYTES, SessionManager, turns_size
+from session_store import SQLiteSessionStore
+
+LONG_MESSAGE = "x" * 10_000
+
+
+def add_turn(manager: SessionManager, session_id: str, text: str = LONG_MESSAGE):
+    _, memory = manager.get_or_create_session(session_id)
+    memory.chat_memory.add_messages([HumanMessage(content=text), AIMessage(content=text)])
+
+
+def test_bytes_follow_turns_and_window():
+    manager = SessionManager(memory_window=1)
+    add_turn(manager, "s1", "a" * 100)
+    add_turn(manager, "s1", "b" * 200)
+    
+    # The window keeps only the last turn
+    expected = RECORD_OVERHEAD_BYTES + turns_size([("user", "b" * 200), ("assistant", "b" * 200)])
+    assert manager.get_stats()["bytes"] == expected
+    
+    manager.clear_session("s1")
+    assert manager.get_stats()["bytes"] == 0
+
+
+def test_long_messages_evict_least_recently_used_sessions(tmp_path):
+    turn_bytes = turns_size([("user", LONG_MESSAGE), ("assistant", LONG_MESSAGE)])
+    budget = 5 * (RECORD_OVERHEAD_BYTES + turn_bytes)
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    manager = SessionManager(store=store, max_bytes=budget)
+    
+    for i in range(20):
+        add_turn(manager, f"s{i}")
+        # Growth is checked on the next access
+        manager.get_or_create_session(f"s{i}")
+        assert manager.get_stats()["bytes"] <= budget
+    
+    stats = manager.get_stats()
+    assert stats["active_sessions"] == 5
+    assert stats["spilled"] == 15
+    
+    # An evicted session comes back from the spill tier with its history
+    _, memory = manager.get_or_create_session("s0")
+    assert [msg.content for msg in memory.chat_memory.messages] == [LONG_MESSAGE, LONG_MESSAGE]
+    assert manager.get_stats()["bytes"] <= budget
+
+
+def test_async_turns_are_counted():
+    manager = SessionManager()
+    
+    async def run():
+        _, memory = await manager.aget_or_create_session("s1")
+        await memory.asave_context({"input": "hello"}, {"output": "namaste"})
+    
+    asyncio.run(run())
+    assert manager.get_stats()["bytes"] == RECORD_OVERHEAD_BYTES + turns_size([("user", "hello"), ("assistant", "namaste")])
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from session_manager import SessionManager
+from session_store import RedisSessionStore, SessionStore
+
+STORE_DELAY = 0.2
+SESSIONS = 8
+
+
+class SlowStore(RedisSessionStore):
+    """Redis store whose reads take a network-like round trip"""
+    
+    def load(self, session_id):
+        time.sleep(STORE_DELAY)
+        return super().load(session_id)
+
+
+def make_worker(server, store_class=RedisSessionStore) -> SessionManager:
+    """One worker process: its own RAM tier in front of the shared Redis"""
+    return SessionManager(store=store_class(client=fakeredis.FakeRedis(server=server)), shared_store=True)
+
+
+async def take_turn(worker: SessionManager, session_id: str, text: str):
+    _, memory = await worker.aget_or_create_session(session_id)
+    await memory.asave_context({"input": text}, {"output": f"answer to {text}"})
+
+
+async def history(worker: SessionManager, session_id: str):
+    _, memory = await worker.aget_or_create_session(session_id)
+    return [message.content for message in memory.chat_memory.messages]
+
+
+def test_workers_continue_each_others_sessions():
+    server = fakeredis.FakeServer()
+    worker_a, worker_b = make_worker(server), make_worker(server)
+    
+    async def run():
+        await take_turn(worker_a, "shared", "first")
+        assert await history(worker_b, "shared") == ["first", "answer to first"]
+        
+        await take_turn(worker_b, "shared", "second")
+        # Worker A already holds the session in RAM and must still see B's turn
+        return await history(worker_a, "shared")
+    
+    assert asyncio.run(run()) == ["first", "answer to first", "second", "answer to second"]
+
+
+def test_store_reads_do_not_block_the_event_loop():
+    worker = make_worker(fakeredis.FakeServer(), store_class=SlowStore)
+    
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*[worker.aget_or_create_session(f"session-{i}") for i in range(SESSIONS)])
+        return time.perf_counter() - started
+    
+    # Inline reads would take SESSIONS * STORE_DELAY
+    assert asyncio.run(run()) < STORE_DELAY * 3
+
+
+def test_incomplete_backend_fails_when_instantiated():
+    class LoadOnlyStore(SessionStore):
+        def load(self, session_id):
+            return None
+    
+    with pytest.raises(TypeError):
+        LoadOnlyStore()
@@ -0,0 +1,42 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tools  # noqa: F401 - loads tools.weather_data
+
+weather_data = sys.modules["tools.weather_data"]
+
+
+@pytest.mark.parametrize("spelling", ["Jaipur,India", "jaipur, india", "jaipur ,  india", " JAIPUR , India ,"])
+def test_location_spellings_share_one_key(spelling):
+    assert weather_data.normalize_location(spelling) == "jaipur, india"
+
+
+def test_india_suffix_is_added_once():
+    assert weather_data.normalize_location("Jaipur,") == "jaipur, india"
+
+
+def test_counters_add_up_under_concurrent_lookups():
+    cache = weather_data.WeatherCache(ttl_seconds=60, max_entries=100)
+    calls = []
+    calls_lock = threading.Lock()
+    
+    def fetch(location):
+        def run():
+            time.sleep(0.01)
+            with calls_lock:
+                calls.append(location)
+            return f"weather in {location}"
+        return run
+    
+    lookups = [f"city-{i % 10}" for i in range(400)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda location: cache.get_or_fetch(location, fetch(location)), lookups))
+    
+    assert results == [f"weather in {location}" for location in lookups]
+    stats = cache.stats()
+    assert stats["upstream_calls"] == len(calls) == 10
+    assert stats["hits"] + stats["coalesced"] + stats["upstream_calls"] == len(lookups)
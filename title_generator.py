@@ -1,38 +1,278 @@
 """
-Title generator for chat sessions using simple text generation with Gemma.
+Title generator for chat sessions: an instant local titler (keyword extraction over domain
+dictionaries, no network) with an optional refinement pass by a small Gemma model.
 """
 
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+import re
+from typing import List, Optional
 from dotenv import load_dotenv
+from model_registry import model_registry
+from tools.crop_calendar import crop_data
+from tools.all_government_schemes import schemes
 
 load_dotenv()
 
-def generate_chat_title(user_message: str) -> str:
-    """
-    Generate a short, descriptive title based on the user's first message.
+# Refine local titles with the LLM (set TITLE_LLM_REFINE=false to keep local titles only).
+# Refinement is also skipped while the title model's concurrency limit is reached
+# (TITLE_LLM_MAX_IN_FLIGHT, see model_registry).
+TITLE_LLM_REFINE = os.getenv("TITLE_LLM_REFINE", "true").lower() in ("1", "true", "yes")
+
+MAX_TITLE_LENGTH = 60
+
+# Letters of any script up to Malayalam; Python's \w alone misses Indic vowel signs
+_WORD_CHARS = r"\w\u0900-\u0D7F"
+_MALAYALAM = re.compile(r"[\u0D00-\u0D7F]")
+
+# Local names of crops in the crop calendar (Hindi, romanized Hindi, Malayalam)
+CROP_ALIASES = {
+    "Paddy": ["rice", "dhan", "धान", "चावल", "നെല്ല്", "അരി"],
+    "Wheat": ["gehun", "gehu", "गेहूं", "गेहूँ", "ഗോതമ്പ്"],
+    "Maize": ["corn", "makka", "मक्का", "ചോളം"],
+    "Cotton": ["kapas", "कपास", "പരുത്തി"],
+    "Sugarcane": ["ganna", "गन्ना", "കരിമ്പ്"],
+    "Groundnut": ["peanut", "moongphali", "मूंगफली", "നിലക്കടല"],
+    "Bajra": ["pearl millet", "बाजरा"],
+    "Chickpea": ["chana", "चना"],
+    "Soybean": ["soya", "सोयाबीन"],
+    "Rapeseed-Mustard": ["sarson", "सरसों", "കടുക്"],
+    "Jute": ["पटसन"],
+    "Sesame": ["til", "तिल", "എള്ള്"],
+}
+
+# Alternative spellings of the crop calendar's state names, and the name to show for them
+STATE_ALIASES = {
+    "Orissa": ["odisha", "ओडिशा"],
+    "Chattisgarh": ["chhattisgarh", "छत्तीसगढ़"],
+    "Uttaranchal": ["uttarakhand", "उत्तराखंड"],
+    "J&K": ["jammu and kashmir", "kashmir"],
+    "Kerala": ["केरल", "കേരളം", "കേരള"],
+    "Punjab": ["पंजाब"],
+    "Haryana": ["हरियाणा"],
+    "Bihar": ["बिहार"],
+    "Rajasthan": ["राजस्थान"],
+    "Maharashtra": ["महाराष्ट्र"],
+    "Uttar Pradesh": ["उत्तर प्रदेश"],
+    "Madhya Pradesh": ["मध्य प्रदेश"],
+    "Tamil Nadu": ["तमिलनाडु", "തമിഴ്നാട്"],
+    "Karnataka": ["कर्नाटक", "കർണാടക"],
+}
+STATE_DISPLAY_NAMES = {
+    "Orissa": "Odisha",
+    "Chattisgarh": "Chhattisgarh",
+    "Uttaranchal": "Uttarakhand",
+    "J&K": "Jammu and Kashmir",
+}
+
+# Local names of schemes, keyed by their name in all_government_schemes.schemes
+SCHEME_ALIASES = {
+    "Pradhan Mantri Kisan Samman Nidhi (PM-KISAN)": ["kisan samman nidhi", "किसान सम्मान निधि"],
+    "Pradhan Mantri Fasal Bima Yojana (PMFBY)": ["fasal bima", "फसल बीमा"],
+    "Pradhan Mantri Kisan MaanDhan Yojana (PM-KMY)": ["kisan maandhan", "किसान मानधन"],
+    "Soil Health Card (SHC)": ["मृदा स्वास्थ्य कार्ड"],
+}
+# Scheme acronyms that are also everyday words; those schemes match on their full name only
+AMBIGUOUS_ACRONYMS = {"MISS", "RAD"}
+
+# (label, keywords); the topic mentioned first in the message wins
+TOPICS = [
+    ("Weather forecast", ["weather", "rain", "rainfall", "forecast", "temperature", "मौसम", "बारिश", "mausam", "baarish", "കാലാവസ്ഥ", "മഴ"]),
+    ("Pest control", ["pest", "pests", "insect", "insects", "pesticide", "कीट", "कीड़े", "കീടം"]),
+    ("Crop disease", ["disease", "diseases", "fungus", "blight", "rust", "रोग", "बीमारी", "രോഗം"]),
+    ("Fertilizer advice", ["fertilizer", "fertiliser", "urea", "dap", "manure", "compost", "खाद", "उर्वरक", "khad", "വളം"]),
+    ("Irrigation", ["irrigation", "watering", "drip", "sprinkler", "सिंचाई", "ജലസേചനം"]),
+    ("Seed selection", ["seed", "seeds", "variety", "varieties", "बीज", "വിത്ത്"]),
+    ("Sowing time", ["sow", "sowing", "planting", "बुवाई", "buvai", "വിതയ്ക്കൽ"]),
+    ("Harvesting", ["harvest", "harvesting", "कटाई", "വിളവെടുപ്പ്"]),
+    ("Mandi prices", ["price", "prices", "rate", "rates", "mandi", "market", "bhav", "भाव", "कीमत", "मंडी", "വില"]),
+    ("Soil health", ["soil", "मिट्टी", "മണ്ണ്"]),
+    ("Crop insurance", ["insurance", "bima", "बीमा", "ഇൻഷുറൻസ്"]),
+    ("Farm loans", ["loan", "loans", "credit", "kcc", "ऋण", "कर्ज", "लोन", "വായ്പ"]),
+    ("Government schemes", ["scheme", "schemes", "yojana", "subsidy", "योजना", "सब्सिडी", "പദ്ധതി"]),
+]
+
+STOP_WORDS = {
+    # English
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "am", "do", "does", "did", "i", "me",
+    "my", "we", "our", "you", "your", "it", "its", "this", "that", "these", "those", "what", "which",
+    "who", "whom", "how", "when", "where", "why", "can", "could", "should", "would", "will", "shall",
+    "may", "might", "must", "to", "of", "in", "on", "at", "for", "from", "by", "with", "about", "and",
+    "or", "but", "if", "so", "as", "into", "than", "then", "there", "here", "please", "tell", "give",
+    "know", "want", "need", "some", "any", "all", "best", "good", "get", "now", "today", "hi", "hello",
+    # Hindi
+    "है", "हैं", "था", "थे", "थी", "का", "की", "के", "को", "में", "से", "पर", "और", "या", "क्या",
+    "कैसे", "कब", "कहाँ", "कहां", "क्यों", "कौन", "कौनसा", "मैं", "मेरे", "मेरी", "मेरा", "हम",
+    "हमें", "आप", "यह", "वह", "ये", "वो", "लिए", "कर", "करें", "करना", "करूं", "होता", "होती",
+    "होगा", "बताइए", "बताओ", "बताएं", "चाहिए", "कृपया", "भी", "तो", "ही", "एक", "अभी", "आज",
+    # Romanized Hindi
+    "hai", "hain", "ka", "ki", "ke", "ko", "mein", "me", "se", "par", "aur", "kya", "kaise", "kab",
+    "kahan", "kyun", "kaun", "mujhe", "mera", "meri", "mere", "ham", "aap", "yeh", "woh", "liye",
+    "karna", "karein", "batao", "bataiye", "chahiye", "bhi", "toh",
+    # Malayalam
+    "ഒരു", "എന്ത്", "എന്താണ്", "എങ്ങനെ", "എപ്പോൾ", "എവിടെ", "എന്തുകൊണ്ട്", "ആര്", "ആണ്",
+    "ഉണ്ട്", "ഇല്ല", "ഞാൻ", "എന്റെ", "എനിക്ക്", "നമ്മുടെ", "നിങ്ങൾ", "ഈ", "ആ", "അത്", "ഇത്",
+    "വേണ്ടി", "കുറിച്ച്", "പറയൂ", "പറയാമോ", "ദയവായി", "ഇന്ന്", "ഇപ്പോൾ", "എന്നാൽ", "കൂടെ",
+}
+
+def _normalize(text: str) -> str:
+    """Lowercase and treat hyphens, slashes and underscores as spaces"""
+    return re.sub(r"\s+", " ", re.sub(r"[-/_]", " ", text.lower())).strip()
+
+def _term_pattern(term: str) -> str:
+    """Whole-word pattern for a term; Malayalam terms also match with case suffixes attached"""
+    if _MALAYALAM.search(term):
+        # Drop a trailing virama so the stem matches inflected forms (നെല്ല് -> നെല്ലിന്)
+        return re.escape(term.rstrip("\u0d4d")) + f"[{_WORD_CHARS}]*"
+    return re.escape(term) + f"(?![{_WORD_CHARS}])"
+
+class _Dictionary:
+    """Finds dictionary terms in normalized text with one compiled alternation"""
+    
+    def __init__(self, terms: dict):
+        # normalized term -> display name
+        self.terms = {_normalize(term): name for term, name in terms.items()}
+        alternation = "|".join(_term_pattern(term) for term in sorted(self.terms, key=len, reverse=True))
+        self.pattern = re.compile(f"(?<![{_WORD_CHARS}])(?:{alternation})")
     
-    Args:
-        user_message: The first message from the user
+    def find(self, text: str) -> List[str]:
+        """Display names of all terms in text, in order of first appearance"""
+        found = []
+        for match in self.pattern.finditer(text):
+            name = self._lookup(match.group(0))
+            if name is not None and name not in found:
+                found.append(name)
+        return found
     
-    Returns:
-        A short title (3-7 words) for the chat session
+    def _lookup(self, matched: str) -> Optional[str]:
+        if matched in self.terms:
+            return self.terms[matched]
+        # An inflected Malayalam word: pick the longest term it starts with
+        for term in sorted(self.terms, key=len, reverse=True):
+            if matched.startswith(term.rstrip("\u0d4d")):
+                return self.terms[term]
+        return None
+
+def _build_crop_dictionary() -> _Dictionary:
+    terms = {}
+    for crops in crop_data.values():
+        for crop in crops:
+            # "Arhar/Tur" and "Mungbean/Urdbean" name one crop two ways; show the first
+            names = crop.split("/")
+            for name in names:
+                terms[name] = names[0]
+            terms[crop] = names[0]
+    for crop, aliases in CROP_ALIASES.items():
+        for alias in aliases:
+            terms[alias] = crop.split("/")[0]
+    terms["rapeseed"] = terms["mustard"] = "Rapeseed-Mustard"
+    return _Dictionary({term: name.lower() for term, name in terms.items()})
+
+def _build_state_dictionary() -> _Dictionary:
+    terms = {state: STATE_DISPLAY_NAMES.get(state, state) for state in crop_data}
+    for state, aliases in STATE_ALIASES.items():
+        for alias in aliases:
+            terms[alias] = STATE_DISPLAY_NAMES.get(state, state)
+    return _Dictionary(terms)
+
+def _build_scheme_dictionary() -> _Dictionary:
+    terms = {}
+    for scheme in schemes:
+        match = re.match(r"(.+?)\s*\((.+)\)$", scheme)
+        full_name, acronym = (match.group(1), match.group(2)) if match else (scheme, None)
+        # Show the acronym farmers know the scheme by, when it has one
+        display = acronym or full_name
+        terms[full_name] = display
+        if acronym and acronym not in AMBIGUOUS_ACRONYMS:
+            terms[acronym] = display
+        for alias in SCHEME_ALIASES.get(scheme, []):
+            terms[alias] = display
+    return _Dictionary(terms)
+
+CROPS = _build_crop_dictionary()
+STATES = _build_state_dictionary()
+SCHEMES = _build_scheme_dictionary()
+TOPIC_TERMS = _Dictionary({keyword: label for label, keywords in TOPICS for keyword in keywords})
+
+def _keywords(text: str, limit: int = 5) -> List[str]:
+    """First content words of a message, stop words removed"""
+    words = []
+    for word in re.findall(f"[{_WORD_CHARS}]+", text):
+        if word.lower() in STOP_WORDS or word.isdigit() or (word.isascii() and len(word) < 2):
+            continue
+        if word.lower() not in (w.lower() for w in words):
+            words.append(word)
+        if len(words) == limit:
+            break
+    return words
+
+def _truncate(user_message: str) -> str:
+    title = user_message[:50].split('.')[0].strip()
+    if len(user_message) > 50:
+        title += "..."
+    return title
+
+def generate_local_title(user_message: str) -> str:
+    """
+    Build a title from the first message without any network call, e.g.
+    "Pest control for cotton in Punjab", "PMFBY for wheat" or "Weather forecast in Kerala".
+    Falls back to the message's first keywords, then to truncation.
     """
+    text = _normalize(user_message)
+    topics = TOPIC_TERMS.find(text)
+    crops = CROPS.find(text)[:2]
+    states = STATES.find(text)
+    found_schemes = SCHEMES.find(text)
     
+    subject = " and ".join(crops)
+    if found_schemes:
+        title = found_schemes[0] + (f" for {subject}" if subject else "")
+    elif topics and subject:
+        title = f"{topics[0]} for {subject}"
+    elif topics:
+        title = topics[0]
+    elif subject:
+        title = f"{subject} cultivation"
+    else:
+        title = ""
+    
+    if title and states:
+        title += f" in {states[0]}"
+    
+    if not title:
+        keywords = _keywords(user_message)
+        # Sentence case, keeping acronyms such as DAP or KCC
+        title = " ".join(word if word.isupper() else word.lower() for word in keywords)
+        title = title or _truncate(user_message) or "New Chat"
+    
+    title = title[:1].upper() + title[1:]
+    return title[:MAX_TITLE_LENGTH].strip()
+
+def refine_chat_title(user_message: str) -> Optional[str]:
+    """
+    Ask the LLM for a title. Returns None when refinement is disabled, when too many title
+    calls are already running, or when the call fails.
+    """
+    limit = model_registry.limit("title")
+    if not TITLE_LLM_REFINE or not limit.try_acquire():
+        return None
     try:
-        print(f"[TITLE GEN] Starting title generation for message: {user_message[:100]}")
-        
-        # Initialize small Gemma model for fast title generation
-        model = ChatGoogleGenerativeAI(
-            model="gemma-3-1b-it",  # Small, fast model
-            api_key=os.environ.get("GOOGLE_API_KEY"),
-            temperature=0.2,  # Low temperature for consistent, focused output
-        )
-        
-        print("[TITLE GEN] Model initialized")
-        
-        # Create a single prompt with instructions and examples (Gemma doesn't support system messages)
-        prompt = f"""Task: Generate a short, descriptive title for a chat conversation.
+        return _generate_llm_title(user_message)
+    except Exception as e:
+        print(f"[TITLE GEN] ERROR: {e}")
+        return None
+    finally:
+        limit.release()
+
+def _generate_llm_title(user_message: str) -> str:
+    """Generate a title with a small Gemma model (remote call)"""
+    
+    print(f"[TITLE GEN] Starting title generation for message: {user_message[:100]}")
+    
+    # Small, fast Gemma model with a low temperature, shared across calls
+    model = model_registry.get("title")
+    
+    # Create a single prompt with instructions and examples (Gemma doesn't support system messages)
+    prompt = f"""Task: Generate a short, descriptive title for a chat conversation.
 
 Instructions:
 - Output ONLY the title text, nothing else
@@ -60,37 +300,26 @@ Output: Government schemes for farmers
 Now generate a title for this input:
 Input: "{user_message}"
 Output:"""
-        
-        print("[TITLE GEN] Invoking model...")
-        # Get response - use invoke with string prompt (no system messages)
-        response = model.invoke(prompt)
-        
-        # Extract title from response
-        title = response.content.strip()
-        
-        # Clean up the title (remove quotes if present, remove "Title:" prefix if added)
-        title = title.strip('"').strip("'").strip()
-        if title.lower().startswith("title:"):
-            title = title[6:].strip()
-        
-        # Take only the first line (in case model generates extra text)
-        title = title.split('\n')[0].strip()
-        
-        # Truncate if too long
-        if len(title) > 60:
-            title = title[:60].strip()
-        
-        print(f"[TITLE GEN] Generated title: {title}")
-        
-        return title
     
-    except Exception as e:
-        print(f"[TITLE GEN] ERROR: {e}")
-        import traceback
-        traceback.print_exc()
-        # Fallback to simple truncation
-        title = user_message[:50].split('.')[0].strip()
-        if len(user_message) > 50:
-            title += "..."
-        print(f"[TITLE GEN] Returning fallback title: {title}")
-        return title
+    print("[TITLE GEN] Invoking model...")
+    # Get response - use invoke with string prompt (no system messages)
+    response = model.invoke(prompt)
+    
+    # Extract title from response
+    title = response.content.strip()
+    
+    # Clean up the title (remove quotes if present, remove "Title:" prefix if added)
+    title = title.strip('"').strip("'").strip()
+    if title.lower().startswith("title:"):
+        title = title[6:].strip()
+    
+    # Take only the first line (in case model generates extra text)
+    title = title.split('\n')[0].strip()
+    
+    # Truncate if too long
+    if len(title) > MAX_TITLE_LENGTH:
+        title = title[:MAX_TITLE_LENGTH].strip()
+    
+    print(f"[TITLE GEN] Generated title: {title}")
+    
+    return title
@@ -0,0 +1,66 @@
+"""
+Background generation of session titles, so a chat response never waits for the title model.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class TitleJobQueue:
+    """Runs at most one title job per session at a time"""
+    
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.deduplicated = 0
+        self.failed = 0
+    
+    def schedule(self, session_id: str, generate: Callable[[], Awaitable[Optional[str]]]) -> asyncio.Task:
+        """Start a title job for session_id unless one is already running, and return the running job"""
+        task = self._in_flight.get(session_id)
+        if task is not None:
+            self.deduplicated += 1
+            return task
+        
+        task = asyncio.create_task(self._run(session_id, generate))
+        self._in_flight[session_id] = task
+        self.started += 1
+        return task
+    
+    async def _run(self, session_id: str, generate: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        try:
+            return await generate()
+        except Exception as e:
+            self.failed += 1
+            print(f"Error generating title for session {session_id}: {e}")
+            return None
+        finally:
+            self._in_flight.pop(session_id, None)
+    
+    def is_pending(self, session_id: str) -> bool:
+        return session_id in self._in_flight
+    
+    async def wait(self, session_id: str, timeout: float) -> Optional[str]:
+        """Wait up to timeout seconds for the session's running job; returns its title or None"""
+        task = self._in_flight.get(session_id)
+        if task is None:
+            return None
+        try:
+            # Shield so a client going away does not cancel the job itself
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return None
+    
+    async def drain(self, timeout: float):
+        """Give running jobs up to timeout seconds to finish (used on shutdown)"""
+        if self._in_flight:
+            await asyncio.wait(list(self._in_flight.values()), timeout=timeout)
+    
+    def stats(self) -> Dict:
+        """Job counters"""
+        return {
+            "in_flight": len(self._in_flight),
+            "started": self.started,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed
+        }
@@ -1,7 +1,141 @@
 from langchain_core.tools import tool
+from requests.adapters import HTTPAdapter
 import requests
+import threading
+import time
 import json
 import os
+import re
+from typing import Callable, Dict, Optional
+from ttl_cache import TTLCache
+
+WEATHER_API_URL = "http://api.weatherapi.com/v1/current.json"
+# Current conditions upstream refresh about every 15 minutes
+WEATHER_CACHE_TTL_SECONDS = float(os.getenv("WEATHER_CACHE_TTL_SECONDS", "600"))
+WEATHER_CACHE_MAX_ENTRIES = int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "2000"))
+# (connect, read) timeouts for the weather API
+WEATHER_TIMEOUT = (
+    float(os.getenv("WEATHER_CONNECT_TIMEOUT_SECONDS", "3")),
+    float(os.getenv("WEATHER_READ_TIMEOUT_SECONDS", "10"))
+)
+
+NOT_AVAILABLE = "Sorry, weather information not available for this location."
+
+class WeatherCache:
+    """
+    Weather API responses by normalized location, fresh for ttl_seconds after they were
+    fetched. Concurrent lookups of the same location share a single upstream call.
+    """
+    
+    def __init__(self, ttl_seconds: float = WEATHER_CACHE_TTL_SECONDS, max_entries: int = WEATHER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        # Values are (fetched_at, response); idle expiry is a backstop, freshness is checked on read
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        # location -> [done event, result] for fetches in progress
+        self._in_flight: Dict[str, list] = {}
+        self.hits = 0
+        self.stale = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+    
+    def get_or_fetch(self, location: str, fetch: Callable[[], Optional[str]]) -> Optional[str]:
+        """Cached response for location, or the result of fetch(); None results are not cached"""
+        entry = self._cache.get(location)
+        if entry is not None:
+            fetched_at, response = entry
+            fresh = time.time() - fetched_at <= self.ttl_seconds
+            with self._lock:
+                if fresh:
+                    self.hits += 1
+                else:
+                    self.stale += 1
+            if fresh:
+                return response
+        
+        with self._lock:
+            flight = self._in_flight.get(location)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[location] = [threading.Event(), None]
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            flight[0].wait()
+            return flight[1]
+        
+        try:
+            flight[1] = fetch()
+            if flight[1] is not None:
+                self._cache.set(location, (time.time(), flight[1]))
+            return flight[1]
+        finally:
+            with self._lock:
+                self._in_flight.pop(location, None)
+            flight[0].set()
+    
+    def stats(self) -> Dict:
+        """Lookup counters; hit_rate counts lookups answered without their own upstream call"""
+        with self._lock:
+            hits, stale, coalesced, upstream_calls = self.hits, self.stale, self.coalesced, self.upstream_calls
+        lookups = hits + coalesced + upstream_calls
+        cache = self._cache.stats()
+        return {
+            "entries": cache["entries"],
+            "max_entries": cache["max_entries"],
+            "hits": hits,
+            "hit_rate": round((hits + coalesced) / lookups, 4) if lookups else 0.0,
+            "stale": stale,
+            "coalesced": coalesced,
+            "upstream_calls": upstream_calls
+        }
+
+def normalize_location(location_name: str) -> str:
+    """Cache key for a location: lower case, single spaces, ", " between parts, with the ", india" suffix applied"""
+    location = " ".join(location_name.lower().split())
+    # "jaipur,india" and "jaipur , india" are the same place
+    location = re.sub(r"\s*,\s*", ", ", location).strip(" ,")
+    # Add India suffix for better location matching
+    if not any(country in location for country in ['india', 'pakistan', 'bangladesh', 'nepal', 'sri lanka']):
+        location = f"{location}, india"
+    return location
+
+def _create_session() -> requests.Session:
+    # Keep-alive connections shared by every tool call (tools run in worker threads)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+http_session = _create_session()
+weather_cache = WeatherCache()
+
+def _fetch_weather(api_key: str, search_location: str) -> Optional[str]:
+    try:
+        response = http_session.get(
+            WEATHER_API_URL,
+            params={"key": api_key, "q": search_location, "aqi": "no"},
+            timeout=WEATHER_TIMEOUT
+        )
+    except requests.RequestException as e:
+        print(f"Weather API request failed for {search_location}: {e}")
+        return None
+    
+    if response.status_code != 200:
+        return None
+    
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    
+    if "error" in data:
+        return None
+    
+    return json.dumps(data)
 
 @tool
 def weather_data(location_name: str):
@@ -11,26 +145,11 @@ def weather_data(location_name: str):
     Args:
     location_name (str): Name of the city, district, or state in India (e.g., "Mumbai", "Delhi", "Punjab", "Jaipur").
     """
-
+    
     api_key = os.getenv("WEATHERAPI_KEY")
     if not api_key:
         return "Weather API key not configured."
     
-    # Add India suffix for better location matching
-    search_location = location_name
-    if not any(country in location_name.lower() for country in ['india', 'pakistan', 'bangladesh', 'nepal', 'sri lanka']):
-        search_location = f"{location_name}, India"
-    
-    response = requests.get(
-        f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={search_location}&aqi=no"
-    )
-
-    if response.status_code != 200:
-        return "Sorry, weather information not available for this location."
-    
-    data = response.json()
-
-    if "error" in data:
-        return "Sorry, weather information not available for this location."
-    
-    return json.dumps(data)
\ No newline at end of file
+    search_location = normalize_location(location_name)
+    result = weather_cache.get_or_fetch(search_location, lambda: _fetch_weather(api_key, search_location))
+    return result if result is not None else NOT_AVAILABLE
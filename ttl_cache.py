@@ -0,0 +1,131 @@
+"""
+Bounded LRU cache with idle-TTL expiry, an optional memory budget and hit/miss counters.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Thread-safe LRU cache bounded by entry count, idle time and (optionally) estimated bytes"""
+    
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # key -> [value, last_accessed, size]; ordered from least to most recently used
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value and mark it recently used, or default on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None or self._is_expired(entry, now):
+                if entry is not None:
+                    self._remove(key)
+                    self.expirations += 1
+                self.misses += 1
+                return default
+            
+            entry[1] = now
+            self._entries.move_to_end(key)
+            # Values such as chat memories grow in place, so re-measure on access
+            if self.sizeof is not None:
+                self._resize(entry, self.sizeof(entry[0]))
+                self._enforce_limits()
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, key: Hashable, value: Any):
+        """Insert or replace a value, evicting least recently used entries beyond the limits"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            size = self.sizeof(value) if self.sizeof is not None else 0
+            self._entries[key] = [value, time.time(), size]
+            self._total_bytes += size
+            self._purge_expired(time.time())
+            self._enforce_limits()
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key and return its value"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+    
+    def purge_expired(self) -> int:
+        """Drop every entry idle for longer than the TTL and return how many were dropped"""
+        with self._lock:
+            return self._purge_expired(time.time())
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+    
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._is_expired(entry, time.time())
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _is_expired(self, entry: list, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry[1] > self.ttl_seconds
+    
+    def _remove(self, key: Hashable) -> Any:
+        value, _, size = self._entries.pop(key)
+        self._total_bytes -= size
+        return value
+    
+    def _resize(self, entry: list, size: int):
+        self._total_bytes += size - entry[2]
+        entry[2] = size
+    
+    def _purge_expired(self, now: float) -> int:
+        # LRU order is also last-access order, so expired entries sit at the front
+        purged = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._is_expired(entry, now):
+                break
+            self._remove(key)
+            purged += 1
+        self.expirations += purged
+        return purged
+    
+    def _enforce_limits(self):
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self._total_bytes > self.max_bytes and len(self._entries) > 1
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1